@@ -8,10 +8,30 @@ load_dotenv()
 db = SQLAlchemy()
 login_manager = LoginManager()
 
-def create_app():
+def create_app(profile: str | None = None):
     app = Flask(__name__)
-    app.config['SECRET_KEY'] = 'change-me'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
+
+    # Konfigurationsprofil: "development" (Standard, Debug-Modus) oder
+    # "production" (für wsgi.py / serve.py, ohne Debugger und Reloader)
+    profile = profile or os.environ.get('APP_PROFILE', 'development')
+    app.config['PROFILE'] = profile
+    app.config['DEBUG'] = profile != 'production'
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'change-me')
+    if profile == 'production':
+        app.config['TEMPLATES_AUTO_RELOAD'] = False
+        app.config['SESSION_COOKIE_HTTPONLY'] = True
+        if app.config['SECRET_KEY'] == 'change-me':
+            app.logger.warning('SECRET_KEY ist nicht gesetzt, Sitzungen sind nicht sicher.')
+
+    # Anzahl vorgeschalteter Reverse-Proxys (X-Forwarded-* Header auswerten)
+    proxies = int(os.environ.get('TRUSTED_PROXIES', 0))
+    if proxies:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+    # Datenbank-URI, Engine-Optionen und SQLite-Pragmas aus der Umgebung
+    from . import database
+    database.configure(app)
 
     # Folder for uploaded profile images
     app.config['PROFILE_IMAGE_FOLDER'] = os.path.join(app.static_folder, 'profile_pics')
@@ -29,6 +49,59 @@ def create_app():
     if 'MAIL_USE_SSL' in os.environ:
         app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL') == '1'
 
+    # Maximale Upload-Größe in Bytes (Standard: 256 MB, 0 = unbegrenzt)
+    max_upload = int(os.environ.get('MAX_CONTENT_LENGTH', 256 * 1024 * 1024))
+    app.config['MAX_CONTENT_LENGTH'] = max_upload or None
+
+    # Anzahl Zeilen pro Bulk-Statement beim CSV-Import
+    app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+
+    # Zeilen pro Datenbank-Batch bei CSV-/Backup-Exporten
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+    # Kompressionsstufe des Backup-ZIPs (0 = keine, 9 = maximal)
+    app.config['BACKUP_COMPRESSION_LEVEL'] = int(os.environ.get('BACKUP_COMPRESSION_LEVEL', 6))
+    # Inkrementelle Backups beginnen so viele Sekunden vor dem letzten Backup,
+    # damit auch Zeilen aus zu dem Zeitpunkt offenen Transaktionen enthalten sind
+    app.config['BACKUP_OVERLAP_SECONDS'] = int(os.environ.get('BACKUP_OVERLAP_SECONDS', 300))
+
+    # Hintergrund-Jobs für Importe (0 = synchron im Request ausführen)
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+
+    # Aktivitäts-Log gepuffert schreiben: spätestens alle N Sekunden bzw. ab
+    # BATCH_SIZE Einträgen (0 Sekunden = synchron im Request, z.B. für Tests)
+    app.config['ACTIVITY_LOG_FLUSH_SECONDS'] = float(os.environ.get('ACTIVITY_LOG_FLUSH_SECONDS', 2))
+    app.config['ACTIVITY_LOG_BATCH_SIZE'] = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 100))
+    # Aufbewahrung: ältere Einträge monatsweise archivieren und löschen (0 = nie)
+    app.config['ACTIVITY_LOG_RETENTION_DAYS'] = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 365))
+    app.config['ACTIVITY_LOG_PRUNE_CHUNK'] = int(os.environ.get('ACTIVITY_LOG_PRUNE_CHUNK', 5000))
+    if os.environ.get('ACTIVITY_LOG_ARCHIVE_FOLDER'):
+        app.config['ACTIVITY_LOG_ARCHIVE_FOLDER'] = os.environ['ACTIVITY_LOG_ARCHIVE_FOLDER']
+
+    # Chat: Long-Polling wartet bis zu N Sekunden auf neue Nachrichten (0 = sofort
+    # antworten), prüft dabei alle POLL_INTERVAL Sekunden auf Nachrichten aus
+    # anderen Prozessen und belegt höchstens WAITERS Threads pro Prozess.
+    # SERVER_THREADS setzen gunicorn.conf.py und serve.py auf die Threads eines
+    # Prozesses; ohne Angabe wartet höchstens die Hälfte, in jedem Fall bleibt
+    # mindestens ein Thread für andere Requests frei.
+    app.config['CHAT_LONGPOLL_SECONDS'] = float(os.environ.get('CHAT_LONGPOLL_SECONDS', 25))
+    app.config['CHAT_POLL_INTERVAL'] = float(os.environ.get('CHAT_POLL_INTERVAL', 2))
+    server_threads = int(os.environ.get('SERVER_THREADS', 4))
+    waiters = int(os.environ.get('CHAT_LONGPOLL_WAITERS', server_threads // 2))
+    app.config['CHAT_LONGPOLL_WAITERS'] = max(1, min(waiters, server_threads - 1))
+
+    # Seitengröße der Listen (per_page-Parameter bis MAX_PAGE_SIZE möglich)
+    app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 50))
+    app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 500))
+    # Gültigkeit zwischengespeicherter Gesamtanzahlen in Sekunden (0 = immer zählen)
+    app.config['COUNT_CACHE_SECONDS'] = int(os.environ.get('COUNT_CACHE_SECONDS', 30))
+    app.config['COUNT_CACHE_MAX_ENTRIES'] = int(os.environ.get('COUNT_CACHE_MAX_ENTRIES', 1000))
+
+    # Angemeldete Benutzer pro Prozess zwischenspeichern (Sekunden, 0 = jedes Mal
+    # laden); Änderungen aus anderen Prozessen werden nach CHECK_INTERVAL bemerkt
+    app.config['USER_CACHE_SECONDS'] = float(os.environ.get('USER_CACHE_SECONDS', 60))
+    app.config['USER_CACHE_CHECK_INTERVAL'] = float(os.environ.get('USER_CACHE_CHECK_INTERVAL', 2))
+
     # Benutzerverwaltung aktivieren über Umgebungsvariable ENABLE_USER_MANAGEMENT (default = aktiviert)
     app.config['ENABLE_USER_MANAGEMENT'] = os.environ.get('ENABLE_USER_MANAGEMENT', '1') == '1'
 
@@ -42,16 +115,33 @@ def create_app():
         from .utils import user_management_enabled
         return dict(enable_user_management=user_management_enabled())
 
+    from . import jobs
+    jobs.init_app(app)
+
+    from . import identity  # noqa: F401  registriert die Session-Events des Benutzer-Caches
+
+    from . import activity
+    activity.init_app(app)
+
+    from . import ledger
+    ledger.init_app(app)
+
+    from . import sales
+    sales.init_app(app)
+
     with app.app_context():
         from . import routes, models
         app.register_blueprint(routes.bp)
+        database.init_engine(app)
         db.create_all()
 
-        # Ensure email column exists
-        from sqlalchemy import inspect
-        inspector = inspect(db.engine)
-        if 'email' not in [c['name'] for c in inspector.get_columns('user')]:
-            db.engine.execute('ALTER TABLE user ADD COLUMN email VARCHAR(120)')
+        # Bestehende Datenbanken auf den aktuellen Schemastand bringen
+        from .migrations import upgrade
+        upgrade(db.engine, app.logger)
+        jobs.fail_stale_jobs()
+
+        # Beim letzten Beenden nicht geschriebene Log-Einträge nachtragen
+        if app.extensions['activity'].replay_spool():
             db.session.commit()
 
         # Mindestens einen Admin-Nutzer sicherstellen
@@ -74,5 +164,9 @@ def create_app():
                 ))
             db.session.commit()
 
+        # Keine offenen Verbindungen an per fork gestartete Worker vererben
+        # (gunicorn --preload); jeder Prozess baut seinen eigenen Pool auf.
+        db.session.remove()
+        db.engine.dispose()
 
     return app
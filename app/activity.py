@@ -0,0 +1,260 @@
+import atexit
+import csv
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import delete, insert
+
+from . import db
+from .models import ActivityLog
+
+
+# Gepuffertes Aktivitäts-Log ----------------------------------------------------
+#
+# Einträge landen zunächst in einer Warteschlange im Speicher und werden von
+# einem Hintergrund-Thread gesammelt geschrieben, sobald ACTIVITY_LOG_BATCH_SIZE
+# Einträge vorliegen oder ACTIVITY_LOG_FLUSH_SECONDS vergangen sind. Der
+# Request bezahlt damit keine zweite Schreibtransaktion mehr. Beim Beenden des
+# Prozesses wird der Rest geschrieben; klappt das nicht, landen die Einträge in
+# einer Spool-Datei, die beim nächsten Start nachgetragen wird.
+
+SPOOL_FILE = 'activity_spool.jsonl'
+
+
+class ActivityWriter:
+    """Collects activity log entries and writes them in batches."""
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get('ACTIVITY_LOG_FLUSH_SECONDS', 2.0)
+        self.batch_size = max(1, app.config.get('ACTIVITY_LOG_BATCH_SIZE', 100))
+        self.spool_path = os.path.join(app.instance_path, SPOOL_FILE)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+
+    @property
+    def synchronous(self) -> bool:
+        return self.interval <= 0
+
+    def record(self, user_id: int, action: str) -> None:
+        """Queue an entry, or write it right away in synchronous mode."""
+        entry = {'user_id': user_id, 'action': action, 'timestamp': datetime.utcnow()}
+        if self.synchronous or self._stopped:
+            db.session.execute(insert(ActivityLog), [entry])
+            db.session.commit()
+            return
+        self._ensure_thread()
+        with self._lock:
+            self._pending.append(entry)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write all queued entries now and return how many were written."""
+        with self._lock:
+            entries, self._pending = self._pending, []
+        if not entries:
+            return 0
+        from .jobs import serialized_write
+
+        with self.app.app_context():
+            try:
+                with serialized_write():
+                    db.session.execute(insert(ActivityLog), entries)
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Beim nächsten Durchlauf erneut versuchen, Reihenfolge bleibt erhalten
+                with self._lock:
+                    self._pending[:0] = entries
+                raise
+            finally:
+                db.session.remove()
+        return len(entries)
+
+    def shutdown(self) -> None:
+        """Stop the background thread and write or spool the remaining entries."""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Aktivitäts-Log konnte beim Beenden nicht geschrieben werden')
+            self._spool()
+
+    def replay_spool(self) -> int:
+        """Insert entries spooled by a previous process; the caller commits."""
+        if not os.path.exists(self.spool_path):
+            return 0
+        # Erst umbenennen, damit parallel startende Worker nichts doppelt schreiben
+        claimed = f'{self.spool_path}.{os.getpid()}'
+        try:
+            os.replace(self.spool_path, claimed)
+        except FileNotFoundError:
+            return 0
+        with open(claimed, encoding='utf-8') as fh:
+            entries = [json.loads(line) for line in fh if line.strip()]
+        for entry in entries:
+            entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+        if entries:
+            db.session.execute(insert(ActivityLog), entries)
+        os.remove(claimed)
+        return len(entries)
+
+    def _spool(self) -> None:
+        with self._lock:
+            entries, self._pending = self._pending, []
+        if not entries:
+            return
+        os.makedirs(os.path.dirname(self.spool_path), exist_ok=True)
+        with open(self.spool_path, 'a', encoding='utf-8') as fh:
+            for entry in entries:
+                fh.write(json.dumps({**entry, 'timestamp': entry['timestamp'].isoformat()}) + '\n')
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            # Nach einem fork (gunicorn --preload) gehört der Puffer dem
+            # Elternprozess, der Thread existiert hier nicht mehr
+            self._pending = []
+            self._wakeup = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='activity-log', daemon=True)
+            self._pid = pid
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Aktivitäts-Log konnte nicht geschrieben werden')
+
+
+# Aufbewahrung ------------------------------------------------------------------
+#
+# Einträge älter als ACTIVITY_LOG_RETENTION_DAYS werden in gzip-komprimierte
+# CSV-Dateien je Monat archiviert und danach in Blöcken gelöscht. Jeder Block
+# ist eine eigene kurze Schreibtransaktion, andere Schreiber kommen dazwischen
+# zum Zug. Wird ein Lauf zwischen Archivieren und Löschen abgebrochen, können
+# Einträge doppelt im Archiv stehen, verloren geht keiner.
+
+ARCHIVE_HEADER = ['id', 'timestamp', 'user_id', 'username', 'action']
+
+
+def archive_folder() -> str:
+    return current_app.config['ACTIVITY_LOG_ARCHIVE_FOLDER']
+
+
+def list_archives() -> list:
+    """Return ``(filename, size)`` of all monthly archives, newest first."""
+    folder = archive_folder()
+    if not os.path.isdir(folder):
+        return []
+    names = sorted((n for n in os.listdir(folder) if n.endswith('.csv.gz')), reverse=True)
+    return [(n, os.path.getsize(os.path.join(folder, n))) for n in names]
+
+
+def _archive(rows) -> set:
+    """Append *rows* to their monthly archive files and return the months."""
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row.timestamp.strftime('%Y-%m'), []).append(row)
+    folder = archive_folder()
+    os.makedirs(folder, exist_ok=True)
+    for month, entries in by_month.items():
+        path = os.path.join(folder, f'activity-{month}.csv.gz')
+        new = not os.path.exists(path)
+        # Jeder Lauf hängt ein eigenes gzip-Member an, gzip liest die Datei am Stück
+        with gzip.open(path, 'at', encoding='utf-8', newline='') as fh:
+            writer = csv.writer(fh)
+            if new:
+                writer.writerow(ARCHIVE_HEADER)
+            writer.writerows(
+                (r.id, r.timestamp.isoformat(sep=' '), r.user_id, r.username or '', r.action) for r in entries
+            )
+    return set(by_month)
+
+
+def prune(now: datetime | None = None, progress=None) -> dict:
+    """Archive and delete entries older than the retention period.
+
+    Returns the number of removed entries and the archived months.
+    """
+    from .jobs import serialized_write
+    from .models import User
+
+    days = current_app.config['ACTIVITY_LOG_RETENTION_DAYS']
+    if not days:
+        return {'archived': 0, 'months': []}
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    chunk = current_app.config['ACTIVITY_LOG_PRUNE_CHUNK']
+    total, months = 0, set()
+    while True:
+        with serialized_write():
+            rows = (
+                db.session.query(
+                    ActivityLog.id, ActivityLog.timestamp, ActivityLog.user_id,
+                    User.username, ActivityLog.action,
+                )
+                .outerjoin(User, User.id == ActivityLog.user_id)
+                .filter(ActivityLog.timestamp < cutoff)
+                .order_by(ActivityLog.timestamp, ActivityLog.id)
+                .limit(chunk)
+                .all()
+            )
+            if not rows:
+                break
+            months |= _archive(rows)
+            db.session.execute(delete(ActivityLog).where(ActivityLog.id.in_([r.id for r in rows])))
+            db.session.commit()
+        total += len(rows)
+        if progress:
+            progress(total)
+    return {'archived': total, 'months': sorted(months)}
+
+
+def init_app(app) -> None:
+    """Attach an :class:`ActivityWriter` to *app* and register ``flask activity-prune``."""
+    app.config.setdefault('ACTIVITY_LOG_FLUSH_SECONDS', 2.0)
+    app.config.setdefault('ACTIVITY_LOG_BATCH_SIZE', 100)
+    app.config.setdefault('ACTIVITY_LOG_RETENTION_DAYS', 365)
+    app.config.setdefault('ACTIVITY_LOG_PRUNE_CHUNK', 5000)
+    app.config.setdefault('ACTIVITY_LOG_ARCHIVE_FOLDER', os.path.join(app.instance_path, 'activity_archive'))
+    writer = ActivityWriter(app)
+    app.extensions['activity'] = writer
+    atexit.register(writer.shutdown)
+
+    @app.cli.command('activity-prune')
+    def activity_prune_command():
+        """Archive and delete activity log entries past the retention period."""
+        summary = prune()
+        months = ', '.join(summary['months']) or '–'
+        click.echo(f"{summary['archived']} Einträge archiviert und gelöscht (Monate: {months})")
+
+
+def record(user_id: int, action: str) -> None:
+    """Log *action* for *user_id* through the writer of the current app."""
+    current_app.extensions['activity'].record(user_id, action)
+
+
+def flush() -> None:
+    """Write queued entries, e.g. before the log is displayed."""
+    current_app.extensions['activity'].flush()
@@ -0,0 +1,189 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import and_, case, func, literal, or_, select, union_all
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import ChatRead, Message, User
+
+
+# Chat --------------------------------------------------------------------------
+#
+# Ein geöffneter Chat lädt zuerst die letzten Nachrichten und fragt danach nur
+# noch Nachrichten mit höherer id ab (Index auf sender_id, receiver_id, id).
+# Beim Long-Polling wartet der Request, bis eine neue Nachricht eintrifft:
+# Nachrichten aus demselben Prozess wecken die Wartenden sofort, Nachrichten
+# aus anderen Worker-Prozessen werden spätestens nach CHAT_POLL_INTERVAL
+# bemerkt. Damit wartende Requests nicht alle Server-Threads belegen, ist ihre
+# Zahl pro Prozess auf CHAT_LONGPOLL_WAITERS begrenzt, immer mindestens einen
+# Thread unter SERVER_THREADS.
+
+_new_message = threading.Condition()
+_generation = 0
+_waiters = None
+_waiters_lock = threading.Lock()
+
+
+def conversation(user_id: int, other_id: int):
+    """Filter for all messages between *user_id* and *other_id*."""
+    return or_(
+        and_(Message.sender_id == user_id, Message.receiver_id == other_id),
+        and_(Message.sender_id == other_id, Message.receiver_id == user_id),
+    )
+
+
+def messages_after(user_id: int, other_id: int, after_id: int, limit: int) -> list:
+    """Return up to *limit* messages newer than *after_id*, oldest first."""
+    return (
+        Message.query.filter(conversation(user_id, other_id), Message.id > after_id)
+        .order_by(Message.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def messages_before(user_id: int, other_id: int, before_id: int | None, limit: int):
+    """Return ``(messages, has_more)`` with up to *limit* messages older than *before_id*.
+
+    Each direction is read backwards from its own index range and only the
+    newest *limit* ids of both are merged, so long conversations are not
+    sorted as a whole.
+    """
+    def direction(sender, receiver):
+        query = select(Message.id).where(Message.sender_id == sender, Message.receiver_id == receiver)
+        if before_id:
+            query = query.where(Message.id < before_id)
+        return select(query.order_by(Message.id.desc()).limit(limit + 1).subquery().c.id)
+
+    both = union_all(direction(user_id, other_id), direction(other_id, user_id)).subquery()
+    newest = select(both.c.id).order_by(both.c.id.desc()).limit(limit + 1)
+    rows = Message.query.filter(Message.id.in_(newest)).order_by(Message.id.desc()).all()
+    has_more = len(rows) > limit
+    return rows[:limit][::-1], has_more
+
+
+def notify() -> None:
+    """Wake up long-polling requests of this process after a new message."""
+    global _generation
+    with _new_message:
+        _generation += 1
+        _new_message.notify_all()
+
+
+def _waiter_slots():
+    global _waiters
+    with _waiters_lock:
+        if _waiters is None:
+            _waiters = threading.BoundedSemaphore(max(1, current_app.config['CHAT_LONGPOLL_WAITERS']))
+        return _waiters
+
+
+def wait_for_messages(user_id: int, other_id: int, after_id: int, limit: int):
+    """Return ``(messages, waited)`` and block until a message arrives or the timeout passes.
+
+    ``waited`` is ``False`` when no waiting slot was free; the client should
+    then poll again after a short pause.
+    """
+    timeout = current_app.config['CHAT_LONGPOLL_SECONDS']
+    # Generation vor der Abfrage merken: eine währenddessen gesendete Nachricht
+    # verhindert dann das Warten, statt erst nach CHAT_POLL_INTERVAL aufzufallen
+    seen = _generation
+    messages = messages_after(user_id, other_id, after_id, limit)
+    if messages or timeout <= 0:
+        return messages, True
+    slots = _waiter_slots()
+    if not slots.acquire(blocking=False):
+        return messages, False
+    try:
+        interval = current_app.config['CHAT_POLL_INTERVAL']
+        deadline = time.monotonic() + timeout
+        while not messages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Verbindung und Lesetransaktion während des Wartens freigeben
+            db.session.close()
+            with _new_message:
+                if seen == _generation:
+                    _new_message.wait(min(interval, remaining))
+            seen = _generation
+            messages = messages_after(user_id, other_id, after_id, limit)
+    finally:
+        slots.release()
+    return messages, True
+
+
+# Gelesen-Status und Übersicht ---------------------------------------------------
+#
+# Pro Benutzerpaar wird die höchste gelesene Nachrichten-id gespeichert. Die
+# Übersicht aller Unterhaltungen ist eine einzige gruppierte Abfrage: gesendete
+# und empfangene Nachrichten werden je über ihren eigenen Index gelesen, nach
+# Gesprächspartner gruppiert und mit der jeweils letzten Nachricht verbunden.
+
+def mark_read(user_id: int, other_id: int, messages) -> None:
+    """Advance the read receipt to the newest of *messages* sent by *other_id*."""
+    newest = max((m.id for m in messages if m.sender_id == other_id), default=None)
+    if newest is None:
+        return
+    receipt = db.session.get(ChatRead, (user_id, other_id))
+    if receipt is None:
+        db.session.add(ChatRead(user_id=user_id, other_id=other_id, last_read_id=newest))
+    elif receipt.last_read_id < newest:
+        receipt.last_read_id = newest
+    else:
+        return
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Zweiter Tab hat den Eintrag gleichzeitig angelegt
+        db.session.rollback()
+        ChatRead.query.filter(
+            ChatRead.user_id == user_id, ChatRead.other_id == other_id, ChatRead.last_read_id < newest
+        ).update({'last_read_id': newest})
+        db.session.commit()
+
+
+def read_up_to(user_id: int, other_id: int) -> int:
+    """Return the id up to which *other_id* has read the messages of *user_id*."""
+    receipt = db.session.get(ChatRead, (other_id, user_id))
+    return receipt.last_read_id if receipt else 0
+
+
+def conversations(user_id: int) -> list:
+    """Return ``(partner, last_message, unread)`` of all conversations, newest first."""
+    sent = select(
+        Message.receiver_id.label('partner'), Message.id.label('id'), literal(0).label('unread'),
+    ).where(Message.sender_id == user_id)
+    received = (
+        select(
+            Message.sender_id.label('partner'),
+            Message.id.label('id'),
+            case((Message.id > func.coalesce(ChatRead.last_read_id, 0), 1), else_=0).label('unread'),
+        )
+        .outerjoin(ChatRead, and_(ChatRead.user_id == user_id, ChatRead.other_id == Message.sender_id))
+        .where(Message.receiver_id == user_id)
+    )
+    both = union_all(sent, received).subquery()
+    grouped = (
+        select(both.c.partner, func.max(both.c.id).label('last_id'), func.sum(both.c.unread).label('unread'))
+        .group_by(both.c.partner)
+        .subquery()
+    )
+    return (
+        db.session.query(User, Message, grouped.c.unread)
+        .join(grouped, grouped.c.partner == User.id)
+        .join(Message, Message.id == grouped.c.last_id)
+        .order_by(grouped.c.last_id.desc())
+        .all()
+    )
+
+
+def to_dict(message: Message, user_id: int) -> dict:
+    return {
+        'id': message.id,
+        'mine': message.sender_id == user_id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+    }
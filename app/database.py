@@ -0,0 +1,65 @@
+import json
+import os
+import re
+
+from sqlalchemy import event, text
+
+from . import db
+
+
+# (Pragma, Umgebungsvariable, Standardwert). Ein leerer Wert in der Umgebung
+# deaktiviert das Pragma.
+SQLITE_PRAGMAS = [
+    # zuerst, damit auch der Wechsel des Journal-Modus auf Sperren wartet
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT', '5000'),
+    ('journal_mode', 'SQLITE_JOURNAL_MODE', 'WAL'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS', 'NORMAL'),
+    ('cache_size', 'SQLITE_CACHE_SIZE', '-65536'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE', '268435456'),
+    ('temp_store', 'SQLITE_TEMP_STORE', 'MEMORY'),
+]
+
+_PRAGMA_VALUE = re.compile(r'^-?[A-Za-z0-9_]+$')
+
+
+def configure(app) -> None:
+    """Read database URI, engine options and SQLite pragmas from the environment."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///inventory.db')
+    options = os.environ.get('DATABASE_ENGINE_OPTIONS')
+    if options:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = json.loads(options)
+
+    pragmas = {}
+    for name, env, default in SQLITE_PRAGMAS:
+        value = os.environ.get(env, default).strip()
+        if not value:
+            continue
+        if not _PRAGMA_VALUE.match(value):
+            raise ValueError(f'Ungültiger Wert für {env}: {value!r}')
+        pragmas[name] = value
+    app.config['SQLITE_PRAGMAS'] = pragmas
+
+
+def init_engine(app) -> None:
+    """Apply the configured pragmas on every new SQLite connection."""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(app.config.get('SQLITE_PRAGMAS', {}))
+
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def active_pragmas() -> list:
+    """Return ``(pragma, value)`` pairs as reported by the current connection."""
+    if db.engine.dialect.name != 'sqlite':
+        return []
+    names = [name for name, _, _ in SQLITE_PRAGMAS] + ['page_size', 'foreign_keys']
+    return [(name, db.session.execute(text(f'PRAGMA {name}')).scalar()) for name in names]
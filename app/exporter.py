@@ -0,0 +1,269 @@
+import csv
+import json
+import zipfile
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+from . import db
+from .models import Article, Movement, Order, OrderItem
+
+
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+class _Echo:
+    """File-like object for ``csv.writer`` that hands the line back."""
+
+    def write(self, value):
+        return value
+
+
+def _batch_size() -> int:
+    return current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+
+
+def iter_csv(header, rows):
+    """Yield CSV text for *header* and *rows* in chunks of about 64 KB."""
+    writer = csv.writer(_Echo())
+    buffer = [writer.writerow(header)]
+    size = len(buffer[0])
+    for row in rows:
+        line = writer.writerow(row)
+        buffer.append(line)
+        size += len(line)
+        if size >= STREAM_BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def parse_date_range(start: str | None, end: str | None):
+    """Return ``(start, end)`` datetimes for ``YYYY-MM-DD`` strings.
+
+    *end* is exclusive and points to the day after the given date, so the
+    whole end day is included. Invalid values are ignored.
+    """
+    start_dt = end_dt = None
+    if start:
+        try:
+            start_dt = datetime.strptime(start, '%Y-%m-%d')
+        except ValueError:
+            pass
+    if end:
+        try:
+            end_dt = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)
+        except ValueError:
+            pass
+    return start_dt, end_dt
+
+
+ARTICLE_EXPORT_HEADER = ['name', 'sku', 'stock', 'minimum_stock', 'category', 'location_primary', 'location_secondary']
+
+
+def iter_article_rows():
+    """Yield article export rows using server side batching."""
+    query = (
+        db.session.query(
+            Article.name, Article.sku, Article.stock, Article.minimum_stock,
+            Article.category, Article.location_primary, Article.location_secondary,
+        )
+        .order_by(Article.id)
+        .yield_per(_batch_size())
+    )
+    for row in query:
+        yield tuple(row)
+
+
+MOVEMENT_EXPORT_HEADER = ['article_sku', 'article_name', 'quantity', 'type', 'note', 'timestamp', 'invoice_number']
+
+
+def iter_movement_rows(start=None, end=None, mtype=None):
+    """Yield movement export rows joined with their article in one query."""
+    query = (
+        db.session.query(
+            Article.sku, Article.name, Movement.quantity, Movement.type,
+            Movement.note, Movement.timestamp, Movement.invoice_number,
+        )
+        .join(Article, Movement.article_id == Article.id)
+    )
+    if start:
+        query = query.filter(Movement.timestamp >= start)
+    if end:
+        query = query.filter(Movement.timestamp < end)
+    if mtype:
+        query = query.filter(Movement.type == mtype)
+    for sku, name, qty, mt, note, ts, invoice in query.order_by(Movement.id).yield_per(_batch_size()):
+        yield sku, name, qty, mt, note, ts, invoice or ''
+
+
+# Backup ----------------------------------------------------------------------
+
+def _backup_article_rows(since=None):
+    query = db.session.query(
+        Article.sku, Article.name, Article.category, Article.stock, Article.minimum_stock,
+        Article.location_primary, Article.location_secondary, Article.image, Article.price,
+    )
+    if since:
+        query = query.filter(Article.updated_at >= since)
+    query = query.order_by(Article.id).yield_per(_batch_size())
+    for sku, name, category, stock, minimum, loc1, loc2, image, price in query:
+        yield (
+            sku or '',
+            name or '',
+            category or '',
+            stock if stock is not None else 0,
+            minimum if minimum is not None else 0,
+            loc1 or '',
+            loc2 or '',
+            image or '',
+            f"{price:.2f}" if price is not None else '',
+        )
+
+
+def _changed_order_ids(since):
+    """Return a select of orders changed since *since*, including their items."""
+    return (
+        select(Order.id).where(Order.updated_at >= since)
+        .union(select(OrderItem.order_id).where(OrderItem.updated_at >= since))
+    )
+
+
+def _backup_order_rows(since=None):
+    query = db.session.query(
+        Order.id, Order.customer_name, Order.customer_address, Order.status, Order.created_at,
+    )
+    if since:
+        query = query.filter(Order.id.in_(_changed_order_ids(since)))
+    query = query.order_by(Order.id).yield_per(_batch_size())
+    for oid, name, address, status, created_at in query:
+        yield (
+            oid,
+            name or '',
+            address or '',
+            status or '',
+            created_at.isoformat() if created_at else '',
+        )
+
+
+def _backup_item_rows(since=None):
+    query = (
+        db.session.query(OrderItem.order_id, Article.sku, OrderItem.quantity, OrderItem.unit_price)
+        .outerjoin(Article, OrderItem.article_id == Article.id)
+    )
+    if since:
+        # Die Wiederherstellung ersetzt alle Positionen einer Bestellung,
+        # daher werden geänderte Bestellungen immer vollständig exportiert
+        query = query.filter(OrderItem.order_id.in_(_changed_order_ids(since)))
+    query = query.order_by(OrderItem.id).yield_per(_batch_size())
+    for oid, sku, qty, price in query:
+        yield oid, sku or '', qty, f"{price:.2f}"
+
+
+def _backup_invoice_rows(since=None):
+    query = (
+        db.session.query(
+            Article.sku, Article.name, Movement.quantity, Movement.type,
+            Movement.note, Movement.timestamp, Movement.invoice_number,
+        )
+        .outerjoin(Article, Movement.article_id == Article.id)
+        .filter(Movement.invoice_number != None)
+    )
+    if since:
+        query = query.filter(Movement.updated_at >= since)
+    query = query.order_by(Movement.id).yield_per(_batch_size())
+    for sku, name, qty, mtype, note, ts, invoice in query:
+        yield (
+            sku or '',
+            name or '',
+            qty,
+            mtype,
+            note or '',
+            ts.isoformat() if ts else '',
+            invoice or '',
+        )
+
+
+BACKUP_MEMBERS = [
+    ('articles.csv', [
+        'sku', 'name', 'category', 'stock', 'minimum_stock',
+        'location_primary', 'location_secondary', 'image', 'price'
+    ], _backup_article_rows),
+    ('orders.csv', ['id', 'customer_name', 'customer_address', 'status', 'created_at'], _backup_order_rows),
+    ('order_items.csv', ['order_id', 'article_sku', 'quantity', 'unit_price'], _backup_item_rows),
+    ('invoice_movements.csv', [
+        'article_sku', 'article_name', 'quantity',
+        'type', 'note', 'timestamp', 'invoice_number'
+    ], _backup_invoice_rows),
+]
+
+
+class _ZipSink:
+    """Write-only, non-seekable target that collects the ZIP bytes written."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+BACKUP_MANIFEST = 'manifest.json'
+
+
+def iter_backup_zip(created_at: datetime, since: datetime | None = None):
+    """Yield the backup ZIP archive piece by piece.
+
+    With *since* only rows changed at or after that time are exported
+    (incremental backup). *created_at* must be taken before the export
+    starts; it is stored in ``manifest.json`` and serves as ``since`` for
+    the next incremental backup.
+
+    ``zipfile`` writes to a non-seekable sink using data descriptors, so
+    neither the CSV members nor the archive are ever held in memory.
+    """
+    level = current_app.config.get('BACKUP_COMPRESSION_LEVEL', 6)
+    sink = _ZipSink()
+    counts = {}
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+        for name, header, rows in BACKUP_MEMBERS:
+            counts[name] = 0
+
+            def counted(rows, name=name):
+                for row in rows:
+                    counts[name] += 1
+                    yield row
+
+            with zf.open(name, 'w', force_zip64=True) as member:
+                for text in iter_csv(header, counted(rows(since))):
+                    member.write(text.encode('utf-8'))
+                    data = sink.drain()
+                    if data:
+                        yield data
+
+        manifest = {
+            'format': 1,
+            'type': 'incremental' if since else 'full',
+            'created_at': created_at.isoformat(),
+            'since': since.isoformat() if since else None,
+            'rows': counts,
+        }
+        zf.writestr(BACKUP_MANIFEST, json.dumps(manifest, indent=2))
+    yield sink.drain()
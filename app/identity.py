@@ -0,0 +1,137 @@
+import threading
+import time
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import Integer, String, cast, event, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Setting, User
+
+
+# Benutzer-Cache für Flask-Login ------------------------------------------------
+#
+# Der user_loader läuft bei jedem angemeldeten Request. Statt den Benutzer
+# jedes Mal zu laden, wird eine Momentaufnahme der für Rechte und Layout
+# nötigen Felder pro Prozess zwischengespeichert (USER_CACHE_SECONDS).
+# Änderungen an Benutzern erhöhen in derselben Transaktion einen gemeinsamen
+# Versionszähler; andere Prozesse prüfen ihn höchstens alle
+# USER_CACHE_CHECK_INTERVAL Sekunden und verwerfen dann ihren Cache. Im
+# eigenen Prozess wird sofort nach dem Commit invalidiert.
+
+USER_VERSION_KEY = '_user_version'
+CACHED_FIELDS = ('id', 'username', 'name', 'gender', 'is_admin', 'is_staff', 'profile_image')
+
+
+class UserIdentity(UserMixin):
+    """Detached snapshot of a :class:`User` used as ``current_user``.
+
+    Other attributes and methods (``email``, ``check_password``, ...) are
+    read from the database row on first access.
+    """
+
+    def __init__(self, user: User):
+        for field in CACHED_FIELDS:
+            setattr(self, field, getattr(user, field))
+
+    def has_staff_rights(self):
+        return self.is_admin or self.is_staff
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        user = db.session.get(User, self.id)
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+_version = None
+_checked_at = 0.0
+
+
+def _read_version():
+    table = Setting.__table__
+    return db.session.execute(select(table.c.value).where(table.c.key == USER_VERSION_KEY)).scalar()
+
+
+def _check_version() -> None:
+    """Drop the cache if another process changed users since the last check."""
+    global _version, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < current_app.config['USER_CACHE_CHECK_INTERVAL']:
+        return
+    _checked_at = now
+    version = _read_version()
+    if version != _version:
+        with _cache_lock:
+            _cache.clear()
+            _version = version
+
+
+def load_identity(user_id: str):
+    """Return the cached identity of *user_id*, loading it if necessary."""
+    ttl = current_app.config['USER_CACHE_SECONDS']
+    if ttl <= 0:
+        return db.session.get(User, int(user_id))
+    _check_version()
+    uid = int(user_id)
+    now = time.monotonic()
+    entry = _cache.get(uid)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    user = db.session.get(User, uid)
+    if user is None:
+        return None
+    identity = UserIdentity(user)
+    with _cache_lock:
+        _cache[uid] = (now + ttl, identity)
+    return identity
+
+
+def invalidate(user_id: int | None = None) -> None:
+    """Forget the cached identity of *user_id* (or all) in this process."""
+    with _cache_lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_user_changes(session, flush_context, instances):
+    changed = {obj.id for obj in (*session.dirty, *session.deleted) if isinstance(obj, User)}
+    if changed:
+        session.info.setdefault('users_pending', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_user_version(session, flush_context):
+    pending = session.info.pop('users_pending', None)
+    if not pending:
+        return
+    conn = session.connection()
+    table = Setting.__table__
+    result = conn.execute(
+        update(table)
+        .where(table.c.key == USER_VERSION_KEY)
+        .values(value=cast(cast(table.c.value, Integer) + 1, String))
+    )
+    if not result.rowcount:
+        conn.execute(insert(table).values(key=USER_VERSION_KEY, value='1'))
+    session.info.setdefault('users_changed', set()).update(pending)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('users_changed', ()):
+        invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_changes(session):
+    session.info.pop('users_pending', None)
+    session.info.pop('users_changed', None)
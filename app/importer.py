@@ -0,0 +1,758 @@
+import codecs
+import csv
+import io
+import json
+import time
+import zipfile
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, or_, select, update
+
+from . import db
+from .jobs import serialized_write
+from .exporter import BACKUP_MANIFEST
+from .models import Article, Movement, Order, OrderItem, Setting
+from .sales import touch_article_report
+from .utils import (
+    get_setting,
+    category_from_sku,
+    csv_multiplier_from_suffix,
+    price_from_sku,
+    price_from_suffix,
+    get_default_price,
+    get_default_minimum_stock,
+)
+
+
+STANDARD_FIELDS = ['name', 'sku', 'stock', 'category', 'location_primary', 'location_secondary']
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def _chunk_size(chunk_size: int | None) -> int:
+    return chunk_size or current_app.config.get('IMPORT_CHUNK_SIZE', 1000)
+
+
+# Streaming ------------------------------------------------------------------
+
+class _PrefixedReader(io.RawIOBase):
+    """Binary reader that returns an already consumed *head* before *stream*."""
+
+    def __init__(self, head: bytes, stream):
+        self._head = memoryview(head)
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._head:
+            n = min(len(buffer), len(self._head))
+            buffer[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _latin1_fallback(error: UnicodeDecodeError):
+    # Einzelne Nicht-UTF-8-Bytes weiter hinten in der Datei als Latin1 lesen
+    return error.object[error.start:error.end].decode('latin1'), error.end
+
+
+codecs.register_error('latin1-fallback', _latin1_fallback)
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Return ``utf-8-sig`` if *sample* decodes as UTF-8, else ``latin1``."""
+    try:
+        # final=False: ein am Ende abgeschnittenes Multibyte-Zeichen ist kein Fehler
+        codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return 'latin1'
+    return 'utf-8-sig'
+
+
+def open_text(stream) -> io.TextIOWrapper:
+    """Wrap a binary upload *stream* in an incrementally decoding text reader.
+
+    The encoding is detected on the first chunk only, so the upload is never
+    held in memory as a whole. Bytes further down that are not valid UTF-8
+    are read as Latin1 instead of failing an import that has already
+    committed its first chunks.
+    """
+    head = stream.read(ENCODING_SAMPLE_SIZE)
+    raw = io.BufferedReader(_PrefixedReader(head, stream))
+    return io.TextIOWrapper(raw, encoding=detect_encoding(head), errors='latin1-fallback', newline='')
+
+
+def open_article_csv(stream):
+    """Return ``(reader, mode)`` for an article CSV or ``(None, None)``.
+
+    Recognises the standard export format and the semicolon separated
+    'lagerverwaltung' format.
+    """
+    text = open_text(stream)
+    header = text.readline()
+    fields = next(csv.reader([header]), [])
+    if fields == STANDARD_FIELDS:
+        return csv.DictReader(text, fieldnames=fields), 'standard'
+    fields = next(csv.reader([header], delimiter=';'), [])
+    if 'Produktname' in fields:
+        return csv.DictReader(text, fieldnames=fields, delimiter=';'), 'lagerverwaltung'
+    return None, None
+
+
+def default_price(sku: str, category: str) -> float:
+    """Return the configured default price for *sku* in *category*."""
+    p = price_from_suffix(sku, category)
+    if p is None:
+        p = price_from_sku(sku)
+    if p is None:
+        p = get_default_price(category)
+    return p or 0.0
+
+
+def _article_values(row: dict, mode: str) -> dict | None:
+    """Map a CSV row of the given format to article column values."""
+    if mode == 'lagerverwaltung':
+        sku = row.get('SKU')
+        name = row.get('Produktname')
+        stock = row.get('Lagerbestand (neu)')
+        minimum = row.get('Mindestbestand')
+        location_primary = row.get('Lagerplatz')
+        category = category_from_sku(sku or '') or 'Sonstiges'
+        location_secondary = ''
+    else:
+        sku = row.get('sku')
+        name = row.get('name')
+        stock = row.get('stock')
+        minimum = row.get('minimum_stock')
+        category = row.get('category')
+        location_primary = row.get('location_primary')
+        location_secondary = row.get('location_secondary')
+
+    sku = (sku or '').strip()
+    if not sku:
+        return None
+    try:
+        stock = int(stock) if stock not in (None, '') else 0
+    except ValueError:
+        return None
+
+    category = (category or '').strip()
+    if not category:
+        category = category_from_sku(sku) or 'Sticker'
+
+    try:
+        if minimum is not None and minimum != '':
+            minimum = int(minimum)
+        else:
+            minimum = get_default_minimum_stock(category)
+    except (ValueError, TypeError):
+        minimum = get_default_minimum_stock(category)
+
+    return dict(
+        sku=sku,
+        name=name,
+        stock=stock,
+        category=category,
+        location_primary=location_primary,
+        location_secondary=location_secondary,
+        minimum_stock=minimum,
+    )
+
+
+class _ArticleUpsert:
+    """Collects article values and writes them as bulk inserts and updates.
+
+    Existing articles are resolved through one preloaded ``sku -> (id, price)``
+    map; newly inserted articles are added to it after every chunk.
+    """
+
+    def __init__(self, chunk_size: int, commit: bool = True, on_flush=None):
+        self.chunk_size = chunk_size
+        self.commit = commit
+        self.on_flush = on_flush
+        self.existing = {
+            sku: (aid, price)
+            for aid, sku, price in db.session.execute(
+                select(Article.id, Article.sku, Article.price)
+            )
+        }
+        self.inserts = {}
+        self.updates = {}
+        self.inserted = 0
+        self.updated = 0
+
+    def article_id(self, sku: str) -> int | None:
+        known = self.existing.get(sku)
+        return known[0] if known else None
+
+    def price(self, sku: str, category: str, price_raw: str) -> float | None:
+        """Return the price to store for *sku* given the raw CSV value."""
+        pending = self.inserts.get(sku)
+        known = self.existing.get(sku)
+        current = pending.get('price') if pending else (known[1] if known else None)
+        if price_raw:
+            try:
+                return float(price_raw.replace(',', '.'))
+            except ValueError:
+                return current  # Beibehalten, falls fehlerhaft
+        if not current:
+            # Nur wenn Preis nicht gesetzt, versuche Default
+            return default_price(sku, category)
+        return current
+
+    def add(self, values: dict) -> None:
+        sku = values['sku']
+        if values.get('price') is None:
+            # Spaltenstandard greifen lassen
+            values.pop('price', None)
+        known = self.existing.get(sku)
+        if sku in self.inserts or known is None:
+            if sku in self.inserts:
+                self.updated += 1
+            else:
+                self.inserted += 1
+            self.inserts[sku] = values
+        else:
+            values['id'] = known[0]
+            self.existing[sku] = (known[0], values.get('price', known[1]))
+            self.updates[known[0]] = values
+            self.updated += 1
+        if len(self.inserts) + len(self.updates) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        with serialized_write():
+            if self.inserts or self.updates:
+                # Bulk-Statements umgehen die Session-Events
+                touch_article_report()
+            if self.inserts:
+                db.session.bulk_insert_mappings(Article, list(self.inserts.values()))
+                skus = list(self.inserts)
+                for aid, sku, price in db.session.execute(
+                    select(Article.id, Article.sku, Article.price).where(Article.sku.in_(skus))
+                ):
+                    self.existing[sku] = (aid, price)
+                self.inserts.clear()
+            if self.updates:
+                db.session.bulk_update_mappings(Article, list(self.updates.values()))
+                self.updates.clear()
+            if self.commit:
+                db.session.commit()
+        if self.on_flush:
+            self.on_flush()
+
+
+def import_articles(rows, mode: str = 'standard', chunk_size: int | None = None,
+                    progress=None) -> dict:
+    """Insert or update articles from CSV *rows* using set-based chunks.
+
+    Every chunk is committed once written, so memory and transaction size
+    stay bounded. *progress* is called with the rows processed so far and
+    the number of skipped rows after each chunk. Returns a summary with the
+    number of ``inserted``, ``updated`` and ``skipped`` rows.
+    """
+    skipped = 0
+
+    def report():
+        if progress:
+            progress(upsert.inserted + upsert.updated + skipped, skipped)
+
+    upsert = _ArticleUpsert(_chunk_size(chunk_size), on_flush=report)
+    for row in rows:
+        values = _article_values(row, mode)
+        if values is None:
+            skipped += 1
+            continue
+        price_raw = (row.get('price') or '').strip()
+        values['price'] = upsert.price(values['sku'], values['category'], price_raw)
+        upsert.add(values)
+    upsert.flush()
+    return {'inserted': upsert.inserted, 'updated': upsert.updated, 'skipped': skipped}
+
+
+# Inventur / Export-Datei ------------------------------------------------------
+
+INVOICE_FIELDS = ('Rechnung', 'Rechennummer', 'Dokument: Dokumentnummer')
+DATE_FORMATS = ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+
+def _parse_export_date(value: str) -> datetime | None:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def open_invoice_csv(stream):
+    """Return ``(reader, invoice_field, date_field)`` for a shop export file.
+
+    ``reader`` is ``None`` if the required columns are missing.
+    """
+    reader = csv.DictReader(open_text(stream), delimiter=';')
+    fieldnames = reader.fieldnames or []
+    invoice_field = None
+    for f in INVOICE_FIELDS:
+        if f in fieldnames:
+            invoice_field = f
+            break
+
+    date_field = None
+    for f in fieldnames:
+        lf = f.lower()
+        if 'datum' in lf or 'date' in lf:
+            date_field = f
+            if 'bestell' in lf or 'dokument' in lf or lf == 'datum' or lf == 'date':
+                break
+
+    if 'Posten: Artikelnummer' not in fieldnames or 'Posten: Anzahl' not in fieldnames:
+        return None, None, None
+    return reader, invoice_field, date_field
+
+
+def sticker_multiplier() -> int:
+    """Return the configured CSV multiplier for sticker articles."""
+    return int(get_setting('sticker_csv_multiplier', '100') or '100')
+
+
+def csv_multiplier(sku: str, category: str | None) -> int | None:
+    """Return the CSV multiplier for an article or ``None`` if none applies."""
+    multiplier = csv_multiplier_from_suffix(sku, category)
+    if multiplier is None and category and category.strip().lower() == 'sticker':
+        multiplier = sticker_multiplier()
+    return multiplier
+
+
+def _booked_invoice_rows(movements: list) -> Counter:
+    """Count the invoice movements of *movements* that are already booked.
+
+    Movements are identified by (article, timestamp, invoice number, quantity)
+    as in the backup restore; the lookup is limited to the articles and the
+    time range of *movements*.
+    """
+    timestamps = [m['timestamp'] for m in movements]
+    invoices = {m['invoice_number'] for m in movements}
+    condition = Movement.invoice_number.in_([i for i in invoices if i is not None])
+    if None in invoices:
+        condition = or_(condition, Movement.invoice_number == None)
+    return Counter(
+        tuple(r) for r in db.session.execute(
+            select(Movement.article_id, Movement.timestamp, Movement.invoice_number, Movement.quantity)
+            .where(
+                Movement.article_id.in_({m['article_id'] for m in movements}),
+                Movement.timestamp.between(min(timestamps), max(timestamps)),
+                condition,
+            )
+        )
+    )
+
+
+def import_invoice_rows(reader, invoice_field, date_field, chunk_size: int | None = None,
+                        progress=None) -> tuple:
+    """Book shop export rows as outgoing movements and reduce the stock.
+
+    Rows are written and committed in chunks; *progress* is called with the
+    rows read so far and the number of unmatched rows after each chunk.
+    Rows with a date that are already booked, e.g. from an earlier attempt
+    that failed halfway, are skipped, so a file can be uploaded again.
+    Returns ``(adjusted, duplicates)``: the number of booked rows that matched
+    an article and the number of skipped duplicates.
+    """
+    chunk_size = _chunk_size(chunk_size)
+    articles = {
+        sku: (aid, category)
+        for aid, sku, category in db.session.execute(
+            select(Article.id, Article.sku, Article.category)
+        )
+    }
+    table = Article.__table__
+    decrement = (
+        update(table)
+        .where(table.c.id == bindparam('b_id'))
+        .values(stock=table.c.stock - bindparam('b_qty'))
+    )
+    adjusted = 0
+    duplicates = 0
+    read = 0
+    dated = []
+    undated = []
+
+    def flush_chunk():
+        nonlocal adjusted, duplicates
+        movements = list(undated)
+        if dated:
+            # Ohne Zeitpunkt lässt sich eine Zeile nicht wiedererkennen
+            booked = _booked_invoice_rows(dated)
+            for m in dated:
+                key = (m['article_id'], m['timestamp'], m['invoice_number'], m['quantity'])
+                if booked[key]:
+                    booked[key] -= 1
+                    duplicates += 1
+                else:
+                    movements.append(m)
+        if movements:
+            deltas = {}
+            for m in movements:
+                deltas[m['article_id']] = deltas.get(m['article_id'], 0) - m['quantity']
+            with serialized_write():
+                db.session.bulk_insert_mappings(Movement, movements)
+                db.session.execute(
+                    decrement, [dict(b_id=aid, b_qty=qty) for aid, qty in deltas.items()]
+                )
+                db.session.commit()
+            adjusted += len(movements)
+        dated.clear()
+        undated.clear()
+        if progress:
+            progress(read, read - adjusted - duplicates)
+
+    for row in reader:
+        read += 1
+        sku = (row.get('Posten: Artikelnummer') or '').strip()
+        qty = (row.get('Posten: Anzahl') or '').strip()
+        invoice = (row.get(invoice_field) or '').strip() if invoice_field else None
+        date_str = (row.get(date_field) or '').strip() if date_field else ''
+        ts = _parse_export_date(date_str) if date_str else None
+        if not sku or not qty:
+            continue
+        try:
+            qty = int(qty)
+        except ValueError:
+            continue
+
+        article = articles.get(sku)
+        if not article:
+            continue
+        aid, category = article
+
+        multiplier = csv_multiplier(sku, category)
+        if multiplier and multiplier != 1:
+            qty *= multiplier
+
+        (dated if ts else undated).append(dict(
+            article_id=aid,
+            quantity=-qty,
+            type='Warenausgang',
+            invoice_number=invoice if invoice else None,
+            note='Import Export-Datei',
+            timestamp=ts if ts else datetime.utcnow(),
+        ))
+        if len(dated) + len(undated) >= chunk_size:
+            flush_chunk()
+
+    flush_chunk()
+    return adjusted, duplicates
+
+
+# Backup-Wiederherstellung -----------------------------------------------------
+
+class BackupFormatError(ValueError):
+    """Raised when a backup file is incomplete or has unexpected columns."""
+
+
+RESTORED_BACKUP_KEY = 'last_restored_backup'
+
+
+def _read_manifest(zf) -> dict | None:
+    if BACKUP_MANIFEST not in zf.namelist():
+        return None
+    try:
+        return json.loads(zf.read(BACKUP_MANIFEST).decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise BackupFormatError('Ungültiges Manifest in der Backup-Datei')
+
+
+def _check_backup_chain(manifest: dict) -> None:
+    """Refuse incremental backups that do not continue the last restore."""
+    if manifest.get('type') != 'incremental':
+        return
+    last = Setting.query.filter_by(key=RESTORED_BACKUP_KEY).first()
+    try:
+        since = datetime.fromisoformat(manifest.get('since') or '')
+        last_restored = datetime.fromisoformat(last.value) if last else None
+    except ValueError:
+        raise BackupFormatError('Ungültiges Manifest in der Backup-Datei')
+    if last_restored is None:
+        raise BackupFormatError(
+            'Inkrementelles Backup abgelehnt: Bitte zuerst ein vollständiges Backup einspielen.'
+        )
+    if since > last_restored:
+        raise BackupFormatError(
+            f"Lücke in der Backup-Kette: Delta ab {manifest['since']}, "
+            f"zuletzt eingespielt Stand {last.value}"
+        )
+
+
+def _record_restored(manifest: dict) -> None:
+    setting = Setting.query.filter_by(key=RESTORED_BACKUP_KEY).first()
+    if not setting:
+        setting = Setting(key=RESTORED_BACKUP_KEY, value='')
+        db.session.add(setting)
+    setting.value = manifest['created_at']
+
+
+def _parse_iso(value: str | None) -> datetime | None:
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _chunks(rows, size: int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _require_fields(reader, fields: set, message: str) -> None:
+    if not reader.fieldnames or not fields.issubset(set(reader.fieldnames)):
+        raise BackupFormatError(message)
+
+
+def _restore_articles(reader, chunk_size: int) -> _ArticleUpsert:
+    upsert = _ArticleUpsert(chunk_size, commit=False)
+    for row in reader:
+        sku = (row.get('sku') or '').strip()
+        if not sku:
+            continue
+        category = (row.get('category') or 'Sticker').strip() or 'Sticker'
+        try:
+            stock = int(row.get('stock') or 0)
+        except ValueError:
+            stock = 0
+        try:
+            minimum = int(row.get('minimum_stock') or 0)
+        except ValueError:
+            minimum = 0
+        upsert.add(dict(
+            sku=sku,
+            name=row.get('name') or '',
+            category=category,
+            stock=stock,
+            minimum_stock=minimum,
+            location_primary=row.get('location_primary') or '',
+            location_secondary=row.get('location_secondary') or '',
+            image=row.get('image') or '',
+            price=upsert.price(sku, category, (row.get('price') or '').strip()),
+        ))
+    upsert.flush()
+    return upsert
+
+
+def _restore_orders(reader, chunk_size: int) -> set:
+    """Upsert orders and drop their items; returns the restored order ids."""
+    restored = set()
+    for chunk in _chunks(reader, chunk_size):
+        orders = {}
+        for row in chunk:
+            try:
+                oid = int(row.get('id') or 0)
+            except ValueError:
+                continue
+            if oid <= 0:
+                continue
+            orders[oid] = dict(
+                id=oid,
+                customer_name=row.get('customer_name') or '',
+                customer_address=row.get('customer_address') or '',
+                status=row.get('status') or 'offen',
+            )
+            created_at = _parse_iso(row.get('created_at'))
+            if created_at:
+                # Sonst beim Einfügen Spaltenstandard, beim Aktualisieren unverändert
+                orders[oid]['created_at'] = created_at
+        if not orders:
+            continue
+        existing = set(db.session.execute(
+            select(Order.id).where(Order.id.in_(list(orders)))
+        ).scalars())
+        db.session.bulk_update_mappings(Order, [v for k, v in orders.items() if k in existing])
+        db.session.bulk_insert_mappings(Order, [v for k, v in orders.items() if k not in existing])
+        # Vorhandene Positionen werden durch die aus dem Backup ersetzt
+        db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(list(existing))))
+        restored.update(orders)
+    return restored
+
+
+def _restore_items(reader, upsert: _ArticleUpsert, orders: set, chunk_size: int) -> int:
+    count = 0
+    for chunk in _chunks(reader, chunk_size):
+        items = []
+        for row in chunk:
+            try:
+                oid = int(row.get('order_id') or 0)
+                qty = int(row.get('quantity') or 0)
+                price = float(row.get('unit_price') or 0)
+            except ValueError:
+                continue
+            article_id = upsert.article_id((row.get('article_sku') or '').strip())
+            if oid not in orders or article_id is None:
+                continue
+            items.append(dict(order_id=oid, article_id=article_id, quantity=qty, unit_price=price))
+        db.session.bulk_insert_mappings(OrderItem, items)
+        count += len(items)
+    return count
+
+
+def _restore_invoice_movements(reader, upsert: _ArticleUpsert, chunk_size: int) -> tuple:
+    """Insert invoice movements not yet present.
+
+    Movements are identified by (article, timestamp, invoice number, quantity),
+    so importing the same backup twice does not double them. Rows without a
+    valid timestamp cannot be identified and are skipped. Returns
+    ``(inserted, duplicates, skipped)``.
+    """
+    inserted = duplicates = skipped = 0
+    for chunk in _chunks(reader, chunk_size):
+        candidates = {}
+        for row in chunk:
+            article_id = upsert.article_id((row.get('article_sku') or '').strip())
+            if article_id is None:
+                continue
+            try:
+                qty = int(row.get('quantity') or 0)
+            except ValueError:
+                qty = 0
+            ts = _parse_iso(row.get('timestamp'))
+            if ts is None:
+                skipped += 1
+                continue
+            invoice = row.get('invoice_number') or None
+            key = (article_id, ts, invoice, qty)
+            if key in candidates:
+                duplicates += 1
+                continue
+            candidates[key] = dict(
+                article_id=article_id,
+                quantity=qty,
+                type=row.get('type') or 'Warenausgang',
+                note=row.get('note') or '',
+                timestamp=ts,
+                invoice_number=invoice,
+            )
+        if not candidates:
+            continue
+        invoices = {key[2] for key in candidates}
+        condition = Movement.invoice_number.in_([i for i in invoices if i is not None])
+        if None in invoices:
+            condition = or_(condition, Movement.invoice_number == None)
+        # Auf Artikel und Zeitraum des Blocks eingrenzen, sonst liest jeder Block
+        # ohne Rechnungsnummer alle Bewegungen ohne Rechnungsnummer
+        timestamps = [key[1] for key in candidates]
+        existing = set(
+            tuple(r) for r in db.session.execute(
+                select(Movement.article_id, Movement.timestamp, Movement.invoice_number, Movement.quantity)
+                .where(
+                    Movement.article_id.in_({key[0] for key in candidates}),
+                    Movement.timestamp.between(min(timestamps), max(timestamps)),
+                    condition,
+                )
+            )
+        )
+        new = [v for k, v in candidates.items() if k not in existing]
+        duplicates += len(candidates) - len(new)
+        db.session.bulk_insert_mappings(Movement, new)
+        inserted += len(new)
+    return inserted, duplicates, skipped
+
+
+def restore_backup(stream, chunk_size: int | None = None) -> dict:
+    """Restore articles, orders and invoice movements from a backup *stream*.
+
+    Accepts a full or incremental backup ZIP or a single articles CSV.
+    Incremental backups must be applied in order on top of the full backup
+    they are based on. All phases run set-based in chunks within one
+    transaction that the caller commits. Returns a summary with row counts,
+    the backup manifest (if any) and the duration of every phase.
+    """
+    chunk_size = _chunk_size(chunk_size)
+    orders_file = None
+    items_file = None
+    invoices_file = None
+    manifest = None
+    timings = {}
+
+    # Mitglieder werden direkt aus dem hochgeladenen Archiv gestreamt
+    if zipfile.is_zipfile(stream):
+        zf = zipfile.ZipFile(stream)
+        names = set(zf.namelist())
+        if not {'articles.csv', 'orders.csv', 'order_items.csv'}.issubset(names):
+            raise BackupFormatError('Backup-Datei unvollständig')
+        manifest = _read_manifest(zf)
+        if manifest:
+            _check_backup_chain(manifest)
+        articles_file = open_text(zf.open('articles.csv'))
+        orders_file = open_text(zf.open('orders.csv'))
+        items_file = open_text(zf.open('order_items.csv'))
+        if 'invoice_movements.csv' in names:
+            invoices_file = open_text(zf.open('invoice_movements.csv'))
+    else:
+        stream.seek(0)
+        articles_file = open_text(stream)
+
+    started = time.perf_counter()
+    reader = csv.DictReader(articles_file)
+    _require_fields(reader, {
+        'sku', 'name', 'category', 'stock', 'minimum_stock',
+        'location_primary', 'location_secondary', 'image', 'price'
+    }, 'Ungültiges Format der Backup-Datei')
+    upsert = _restore_articles(reader, chunk_size)
+    timings['articles'] = time.perf_counter() - started
+
+    orders = set()
+    if orders_file:
+        started = time.perf_counter()
+        reader = csv.DictReader(orders_file)
+        _require_fields(reader, {'id', 'customer_name', 'customer_address', 'status', 'created_at'},
+                        'Ungültiges Format der Orders-Datei')
+        orders = _restore_orders(reader, chunk_size)
+        timings['orders'] = time.perf_counter() - started
+
+    items = 0
+    if items_file:
+        started = time.perf_counter()
+        reader = csv.DictReader(items_file)
+        _require_fields(reader, {'order_id', 'article_sku', 'quantity', 'unit_price'},
+                        'Ungültiges Format der Order-Items-Datei')
+        items = _restore_items(reader, upsert, orders, chunk_size)
+        timings['order_items'] = time.perf_counter() - started
+
+    movements = duplicates = skipped_movements = 0
+    if invoices_file:
+        started = time.perf_counter()
+        reader = csv.DictReader(invoices_file)
+        _require_fields(reader, {'article_sku', 'quantity', 'type', 'note', 'timestamp', 'invoice_number'},
+                        'Ungültiges Format der Invoice-Movements-Datei')
+        movements, duplicates, skipped_movements = _restore_invoice_movements(reader, upsert, chunk_size)
+        timings['invoice_movements'] = time.perf_counter() - started
+
+    if manifest and manifest.get('created_at'):
+        _record_restored(manifest)
+    for phase, seconds in timings.items():
+        current_app.logger.info('Backup-Import %s: %.2f s', phase, seconds)
+    return dict(
+        manifest=manifest,
+        articles_inserted=upsert.inserted,
+        articles_updated=upsert.updated,
+        orders=len(orders),
+        order_items=items,
+        movements=movements,
+        duplicate_movements=duplicates,
+        skipped_movements=skipped_movements,
+        timings=timings,
+    )
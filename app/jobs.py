@@ -0,0 +1,288 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from . import db
+from .models import ActivityLog, Job
+
+
+# SQLite erlaubt nur einen Schreiber gleichzeitig. Alle Commits der
+# Hintergrund-Jobs und des gepufferten Aktivitäts-Logs laufen deshalb innerhalb
+# dieses Locks, damit sich die Threads eines Prozesses nicht gegenseitig in den
+# busy_timeout treiben. Der Lock gilt nur innerhalb eines Prozesses: Requests
+# und andere Worker-Prozesse schreiben daneben und warten bei Bedarf über
+# SQLITE_BUSY_TIMEOUT auf die Datenbank.
+_write_lock = threading.RLock()
+
+
+@contextmanager
+def serialized_write():
+    """Hold the writer lock of this process for one write transaction."""
+    with _write_lock:
+        yield
+
+
+ABORTED_MESSAGE = 'Job wurde durch einen Neustart abgebrochen.'
+
+
+class JobRunner:
+    """Executes queued jobs on a thread pool inside the app context."""
+
+    def __init__(self, app):
+        self.app = app
+        workers = app.config.get('JOB_WORKERS', 2)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job') if workers else None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, job_id: int) -> None:
+        if self.executor is None:
+            # Synchroner Modus (JOB_WORKERS=0), z.B. für Tests
+            _run_job(job_id)
+        else:
+            with self.lock:
+                self.pending.add(job_id)
+            self.executor.submit(self._run, job_id)
+
+    def _run(self, job_id: int) -> None:
+        with self.app.app_context():
+            try:
+                _run_job(job_id)
+            finally:
+                db.session.remove()
+                with self.lock:
+                    self.pending.discard(job_id)
+
+    def shutdown(self) -> None:
+        """Stop taking jobs and mark the unfinished jobs of this process as failed.
+
+        Called when a server worker exits or is aborted (see gunicorn.conf.py),
+        so a status page does not wait for a job that no process runs anymore.
+        A job that still completes afterwards records its own result.
+        """
+        if self.executor is None:
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            job_ids = list(self.pending)
+        if not job_ids:
+            return
+        table = Job.__table__
+        try:
+            # Eigene Verbindung ohne den Schreib-Lock, den ein Job-Thread
+            # gerade halten kann
+            with db.engine.begin() as conn:
+                conn.execute(
+                    table.update()
+                    .where(table.c.id.in_(job_ids), table.c.status.in_(['wartend', 'läuft']))
+                    .values(status='fehlgeschlagen', message=ABORTED_MESSAGE, finished_at=datetime.utcnow())
+                )
+        except Exception:
+            self.app.logger.exception('Abgebrochene Jobs %s konnten nicht markiert werden', job_ids)
+
+
+def init_app(app) -> None:
+    """Configure the upload folder and attach a job runner to *app*."""
+    app.config.setdefault('JOB_WORKERS', 2)
+    app.config.setdefault('JOB_UPLOAD_FOLDER', os.path.join(app.instance_path, 'uploads'))
+    os.makedirs(app.config['JOB_UPLOAD_FOLDER'], exist_ok=True)
+    app.extensions['jobs'] = JobRunner(app)
+
+
+def fail_stale_jobs() -> None:
+    """Mark jobs that were queued or running when the process died as failed."""
+    stale = Job.query.filter(Job.status.in_(['wartend', 'läuft'])).all()
+    for job in stale:
+        job.status = 'fehlgeschlagen'
+        job.message = ABORTED_MESSAGE
+        job.finished_at = datetime.utcnow()
+    if stale:
+        with serialized_write():
+            db.session.commit()
+
+
+def _count_lines(path: str) -> int:
+    count = 0
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            count += block.count(b'\n')
+    return count
+
+
+def enqueue(kind: str, file=None, user_id: int | None = None) -> Job:
+    """Queue a job of *kind*, spooling an uploaded *file* to disk if given."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Unbekannter Job-Typ: {kind}')
+    job = Job(kind=kind, user_id=user_id)
+    if file is not None:
+        folder = current_app.config['JOB_UPLOAD_FOLDER']
+        filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename or 'upload')}"
+        job.path = os.path.join(folder, filename)
+        file.save(job.path)
+        if kind != 'backup_import':
+            # Kopfzeile abziehen
+            job.total = max(_count_lines(job.path) - 1, 0)
+    db.session.add(job)
+    with serialized_write():
+        db.session.commit()
+    current_app.extensions['jobs'].submit(job.id)
+    return job
+
+
+def _update_progress(job_id: int, processed: int, errors: int = 0) -> None:
+    with serialized_write():
+        Job.query.filter_by(id=job_id).update({'processed': processed, 'errors': errors})
+        db.session.commit()
+
+
+def _run_job(job_id: int) -> None:
+    job = Job.query.get(job_id)
+    if job is None or job.status != 'wartend':
+        return
+    job.status = 'läuft'
+    job.started_at = datetime.utcnow()
+    with serialized_write():
+        db.session.commit()
+
+    handler = JOB_HANDLERS[job.kind]
+    try:
+        message, action = handler(job, lambda processed, errors=0: _update_progress(job_id, processed, errors))
+    except Exception as e:
+        db.session.rollback()
+        if isinstance(e, ValueError):
+            current_app.logger.info('Job %s abgebrochen: %s', job_id, e)
+        else:
+            current_app.logger.exception('Job %s fehlgeschlagen', job_id)
+        job = Job.query.get(job_id)
+        job.status = 'fehlgeschlagen'
+        if isinstance(e, UnicodeDecodeError):
+            job.message = 'Datei konnte nicht vollständig gelesen werden. Bitte UTF-8 oder Latin1 codierte CSV verwenden.'
+        elif isinstance(e, ValueError) and str(e):
+            job.message = str(e)
+        else:
+            job.message = 'Fehler beim Verarbeiten der Datei.'
+    else:
+        job = Job.query.get(job_id)
+        job.status = 'fertig'
+        job.message = message
+        if action and job.user_id:
+            db.session.add(ActivityLog(user_id=job.user_id, action=action))
+    job.finished_at = datetime.utcnow()
+    with serialized_write():
+        db.session.commit()
+
+    if job.path and os.path.exists(job.path):
+        os.remove(job.path)
+
+
+# Job-Typen -------------------------------------------------------------------
+#
+# Ein Handler erhält den Job sowie eine Fortschritts-Funktion und liefert
+# ``(flash_nachricht, log_aktion)`` zurück. Fehler werden als Exception mit
+# lesbarer Nachricht gemeldet.
+
+def _article_import(job, progress):
+    from .importer import open_article_csv, import_articles
+
+    with open(job.path, 'rb') as fh:
+        reader, mode = open_article_csv(fh)
+        if reader is None:
+            raise ValueError('Dateiformat nicht erkannt oder Spalten fehlen')
+        summary = import_articles(reader, mode, progress=progress)
+    message = (
+        f"Import abgeschlossen – {summary['inserted']} neu, "
+        f"{summary['updated']} aktualisiert, {summary['skipped']} übersprungen"
+    )
+    return message, 'CSV-Import durchgeführt'
+
+
+def _invoice_import(job, progress):
+    from .importer import open_invoice_csv, import_invoice_rows
+
+    with open(job.path, 'rb') as fh:
+        reader, invoice_field, date_field = open_invoice_csv(fh)
+        if reader is None:
+            raise ValueError('Erforderliche Spalten fehlen.')
+        adjusted, duplicates = import_invoice_rows(reader, invoice_field, date_field, progress=progress)
+    skipped = f' {duplicates} Zeilen waren bereits gebucht und wurden übersprungen.' if duplicates else ''
+    if not adjusted:
+        if duplicates:
+            return f'CSV-Import abgeschlossen – Keine neuen Buchungen.{skipped}', None
+        return 'CSV-Import abgeschlossen – Keine passenden Artikel gefunden.', None
+    return (
+        f'CSV-Import abgeschlossen – {adjusted} Artikel angepasst.{skipped}',
+        f'Inventur-CSV importiert – {adjusted} Artikel angepasst',
+    )
+
+
+PHASE_NAMES = {
+    'articles': 'Artikel',
+    'orders': 'Bestellungen',
+    'order_items': 'Positionen',
+    'invoice_movements': 'Rechnungsbewegungen',
+}
+
+
+def _backup_import(job, progress):
+    from .importer import restore_backup
+    from .sales import rebuild
+
+    with open(job.path, 'rb') as fh:
+        with serialized_write():
+            summary = restore_backup(fh)
+            # Die Wiederherstellung schreibt per Bulk-Statement an den
+            # Session-Events vorbei, daher die Statistik komplett neu aufbauen
+            rebuild(db.session.connection())
+            db.session.commit()
+    manifest = summary['manifest']
+    title = 'Inkrementelles Backup importiert' if manifest and manifest.get('type') == 'incremental' else 'Backup importiert'
+    timings = ', '.join(
+        f'{PHASE_NAMES.get(phase, phase)} {seconds:.1f} s' for phase, seconds in summary['timings'].items()
+    )
+    movements = f"{summary['duplicate_movements']} bereits vorhanden"
+    if summary['skipped_movements']:
+        movements += f", {summary['skipped_movements']} ohne gültigen Zeitpunkt übersprungen"
+    message = (
+        f"{title} – {summary['articles_inserted']} Artikel neu, "
+        f"{summary['articles_updated']} aktualisiert, {summary['orders']} Bestellungen, "
+        f"{summary['order_items']} Positionen, {summary['movements']} Rechnungsbewegungen "
+        f"({movements}). Dauer: {timings}"
+    )
+    return message, title
+
+
+def _stock_reconcile(job, progress):
+    from .ledger import reconcile
+
+    with serialized_write():
+        summary = reconcile()
+        db.session.commit()
+    message = (
+        f"Bestandsabgleich abgeschlossen – {summary['snapshots']} von {summary['articles']} Artikeln "
+        f"erfasst, {summary['new']} erstmals, {summary['drift']} mit Abweichung."
+    )
+    return message, 'Bestandsabgleich durchgeführt'
+
+
+def _activity_prune(job, progress):
+    from .activity import prune
+
+    summary = prune(progress=progress)
+    months = ', '.join(summary['months']) or 'keine'
+    message = f"Aktivitäts-Log bereinigt – {summary['archived']} Einträge archiviert (Monate: {months})."
+    return message, 'Aktivitäts-Log bereinigt'
+
+
+JOB_HANDLERS = {
+    'article_import': _article_import,
+    'invoice_import': _invoice_import,
+    'backup_import': _backup_import,
+    'stock_reconcile': _stock_reconcile,
+    'activity_prune': _activity_prune,
+}
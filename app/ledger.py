@@ -0,0 +1,173 @@
+from datetime import datetime
+
+import click
+from sqlalchemy import case, func, insert, literal, select, update
+
+from . import db
+from .models import Article, Movement, StockSnapshot
+from .pagination import invalidate_counts
+
+
+# Bestandsbuchungen -------------------------------------------------------------
+#
+# Bestandsänderungen laufen als einzelnes UPDATE in der Datenbank statt als
+# Lesen-Ändern-Schreiben in Python. So gehen bei parallelen Requests (auch aus
+# mehreren Prozessen) keine Buchungen verloren.
+
+def add_stock(article: Article, quantity: int) -> int:
+    """Atomically add *quantity* (may be negative) and return the new stock."""
+    table = Article.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == article.id)
+        .values(stock=func.coalesce(table.c.stock, 0) + quantity)
+    )
+    # Am ORM vorbei gebucht, Anzahl "Unterbestand" neu zählen
+    invalidate_counts('articles')
+    # Innerhalb der Transaktion liefert das Nachladen den eigenen Stand
+    db.session.expire(article, ['stock'])
+    return article.stock
+
+
+def take_stock(article: Article, quantity: int) -> bool:
+    """Atomically remove *quantity* if enough stock is left.
+
+    Returns ``False`` and changes nothing when the stock is insufficient.
+    """
+    table = Article.__table__
+    result = db.session.execute(
+        update(table)
+        .where(table.c.id == article.id, table.c.stock >= quantity)
+        .values(stock=table.c.stock - quantity)
+    )
+    invalidate_counts('articles')
+    db.session.expire(article, ['stock'])
+    return result.rowcount == 1
+
+
+# Bestandsabgleich --------------------------------------------------------------
+#
+# ``Article.stock`` wird an mehreren Stellen direkt verändert. Ein Abgleich
+# schreibt pro Artikel einen Snapshot und vergleicht dabei den aktuellen
+# Bestand mit dem letzten Snapshot plus allen seitdem gebuchten Bewegungen.
+# Alles geschieht in einem INSERT ... SELECT, also ohne Artikel zu laden.
+
+def _latest_snapshots():
+    """Subquery with the most recent snapshot of every article."""
+    latest = (
+        select(StockSnapshot.article_id, func.max(StockSnapshot.id).label('id'))
+        .group_by(StockSnapshot.article_id)
+        .subquery()
+    )
+    return (
+        select(StockSnapshot.article_id, StockSnapshot.stock, StockSnapshot.last_movement_id)
+        .join(latest, latest.c.id == StockSnapshot.id)
+        .subquery('last')
+    )
+
+
+def reconcile(now: datetime | None = None) -> dict:
+    """Take snapshots and return counts of checked, snapshotted and drifting articles.
+
+    Articles without a previous snapshot get their first one (no expected
+    value). Articles whose stock and movements did not change since their
+    last snapshot are skipped. The caller commits.
+    """
+    now = now or datetime.utcnow()
+    # Höchste Bewegung im selben Statement bestimmen, damit Bestand und
+    # Bewegungen aus demselben Datenbankstand stammen
+    high_water = select(func.coalesce(func.max(Movement.id), 0)).scalar_subquery()
+
+    last = _latest_snapshots()
+    moved = (
+        select(Movement.article_id, func.sum(Movement.quantity).label('quantity'))
+        .join(last, last.c.article_id == Movement.article_id)
+        .where(Movement.id > last.c.last_movement_id, Movement.id <= high_water)
+        .group_by(Movement.article_id)
+        .subquery('moved')
+    )
+    stock = func.coalesce(Article.stock, 0)
+    expected = case(
+        (last.c.article_id == None, None),
+        else_=last.c.stock + func.coalesce(moved.c.quantity, 0),
+    )
+    rows = (
+        select(Article.id, literal(now), stock, expected, high_water)
+        .outerjoin(last, last.c.article_id == Article.id)
+        .outerjoin(moved, moved.c.article_id == Article.id)
+        .where((last.c.article_id == None) | (moved.c.quantity != None) | (last.c.stock != stock))
+    )
+    db.session.execute(
+        insert(StockSnapshot).from_select(
+            ['article_id', 'taken_at', 'stock', 'expected', 'last_movement_id'], rows
+        )
+    )
+
+    counts = db.session.query(
+        func.count(StockSnapshot.id),
+        func.count(StockSnapshot.expected),
+        func.sum(case((StockSnapshot.stock != StockSnapshot.expected, 1), else_=0)),
+    ).filter(StockSnapshot.taken_at == now).one()
+    return {
+        'articles': db.session.query(func.count(Article.id)).scalar(),
+        'snapshots': counts[0],
+        'new': counts[0] - counts[1],
+        'drift': counts[2] or 0,
+    }
+
+
+def drifting_articles(limit: int = 200):
+    """Return ``(article, snapshot)`` pairs whose latest snapshot shows drift."""
+    latest = select(func.max(StockSnapshot.id)).group_by(StockSnapshot.article_id)
+    return (
+        db.session.query(Article, StockSnapshot)
+        .join(StockSnapshot, StockSnapshot.article_id == Article.id)
+        .filter(StockSnapshot.id.in_(latest), StockSnapshot.expected != StockSnapshot.stock)
+        .order_by(func.abs(StockSnapshot.stock - StockSnapshot.expected).desc(), Article.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def stock_at(article: Article, when: datetime) -> int:
+    """Return the stock of *article* at *when* according to the movement log.
+
+    Starts from the latest snapshot taken at or before *when* and adds the
+    movements booked after it up to *when*. Only the tail since that
+    snapshot is read. Without a snapshot the value is derived backwards
+    from the current stock.
+    """
+    snap = (
+        StockSnapshot.query.filter(StockSnapshot.article_id == article.id, StockSnapshot.taken_at <= when)
+        .order_by(StockSnapshot.taken_at.desc(), StockSnapshot.id.desc())
+        .first()
+    )
+    moves = db.session.query(func.coalesce(func.sum(Movement.quantity), 0)).filter(
+        Movement.article_id == article.id
+    )
+    if snap is None:
+        later = moves.filter(Movement.timestamp > when).scalar()
+        return (article.stock or 0) - later
+
+    # nach dem Snapshot gebucht und bis ``when`` wirksam
+    booked = moves.filter(Movement.id > snap.last_movement_id, Movement.timestamp <= when).scalar()
+    # im Snapshot enthalten, aber erst nach ``when`` datiert
+    future = moves.filter(Movement.id <= snap.last_movement_id, Movement.timestamp > when).scalar()
+    return snap.stock + booked - future
+
+
+def init_app(app) -> None:
+    """Register the ``flask stock-reconcile`` command for cron jobs."""
+
+    @app.cli.command('stock-reconcile')
+    def stock_reconcile_command():
+        """Take stock snapshots and report articles with drift."""
+        from .jobs import serialized_write
+
+        with serialized_write():
+            summary = reconcile()
+            db.session.commit()
+        click.echo(
+            f"{summary['snapshots']} Snapshots geschrieben, "
+            f"{summary['new']} neue Artikel, {summary['drift']} Abweichungen"
+        )
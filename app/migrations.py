@@ -0,0 +1,188 @@
+# Versionierte Schema-Migrationen.
+#
+# Neue Tabellen einer frischen Datenbank legt ``db.create_all()`` an. Ältere
+# Datenbanken werden durch die geordneten Schritte unten aktualisiert; jeder
+# ausgeführte Schritt wird in ``schema_version`` vermerkt. Schritte müssen
+# idempotent sein, da ``create_all`` die Objekte bereits angelegt haben kann.
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """Register the decorated function as schema step *version*."""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def _add_column(conn, table: str, column: str, ddl: str) -> None:
+    if column not in [c['name'] for c in inspect(conn).get_columns(table)]:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+
+def _create_index(conn, name: str, table: str, *columns: str) -> None:
+    cols = ', '.join(columns)
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({cols})'))
+
+
+# Schritte ---------------------------------------------------------------------
+
+@migration(1, 'E-Mail-Spalte für Benutzer')
+def _user_email(conn):
+    _add_column(conn, 'user', 'email', 'VARCHAR(120)')
+
+
+@migration(2, 'Änderungszeitpunkt für inkrementelle Backups')
+def _updated_at(conn):
+    for table in ('article', 'order', 'order_item', 'movement'):
+        _add_column(conn, table, 'updated_at', 'DATETIME')
+
+
+@migration(3, 'Indizes für Historie, Rechnungen, Bestellungen, Chat und Log')
+def _indexes(conn):
+    # Historie: WHERE article_id = ? ORDER BY timestamp
+    _create_index(conn, 'ix_movement_article_id_timestamp', 'movement', 'article_id', 'timestamp')
+    _create_index(conn, 'ix_movement_order_id', 'movement', 'order_id')
+    # Rechnungen: WHERE invoice_number IS NOT NULL ORDER BY timestamp DESC
+    _create_index(conn, 'ix_movement_invoice_number', 'movement', 'invoice_number')
+    _create_index(conn, 'ix_movement_timestamp', 'movement', 'timestamp')
+    # Bestellliste: WHERE status = ? ORDER BY created_at DESC
+    _create_index(conn, 'ix_order_status_created_at', 'order', 'status', 'created_at')
+    _create_index(conn, 'ix_order_created_at', 'order', 'created_at')
+    _create_index(conn, 'ix_article_category', 'article', 'category')
+    _create_index(conn, 'ix_order_item_order_id', 'order_item', 'order_id')
+    _create_index(conn, 'ix_order_item_article_id', 'order_item', 'article_id')
+    # Chat: WHERE sender_id = ? AND receiver_id = ? ORDER BY timestamp
+    _create_index(conn, 'ix_message_sender_receiver_timestamp', 'message', 'sender_id', 'receiver_id', 'timestamp')
+    # Log: WHERE user_id = ? ORDER BY timestamp DESC bzw. nur ORDER BY timestamp DESC
+    _create_index(conn, 'ix_activity_log_user_id_timestamp', 'activity_log', 'user_id', 'timestamp')
+    _create_index(conn, 'ix_activity_log_timestamp', 'activity_log', 'timestamp')
+
+
+@migration(4, 'Indizes für die Sortierung der Artikelübersicht')
+def _article_sort_indexes(conn):
+    _create_index(conn, 'ix_article_name', 'article', 'name')
+    # Ausdrucksindizes, identisch zu den Sortierschlüsseln in models.py
+    _create_index(conn, 'ix_article_stock_key', 'article', 'coalesce(stock, 0)')
+    _create_index(conn, 'ix_article_deficit_key', 'article', 'coalesce(minimum_stock, 0) - coalesce(stock, 0)')
+    _create_index(conn, 'ix_article_category_key', 'article', "coalesce(category, '')")
+
+
+def _create_fts(conn, table: str, columns: list) -> None:
+    """Create ``<table>_fts`` over *columns* and the triggers keeping it in sync."""
+    fts = f'{table}_fts'
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    try:
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, "
+            f"content='{table}', content_rowid='id', prefix='2 3')"
+        ))
+    except OperationalError:
+        # SQLite ohne FTS5: die Suche verwendet weiterhin LIKE
+        return
+    conn.execute(text(
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{table}" BEGIN '
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+    ))
+    conn.execute(text(
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{table}" BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+    ))
+    # Nur bei Änderung der indizierten Spalten, z.B. Bestandsbuchungen bleiben unberührt
+    conn.execute(text(
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON "{table}" BEGIN '
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+    ))
+    conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+@migration(5, 'Volltextsuche (FTS5) für Artikel')
+def _article_fts(conn):
+    if conn.dialect.name == 'sqlite':
+        _create_fts(conn, 'article', ['name', 'sku', 'category', 'location_primary', 'location_secondary'])
+
+
+@migration(6, 'Volltextsuche (FTS5) für Kunden in Bestellungen')
+def _order_fts(conn):
+    if conn.dialect.name == 'sqlite':
+        _create_fts(conn, 'order', ['customer_name', 'customer_address'])
+
+
+@migration(7, 'Tägliche Verkaufsstatistik aus bestehenden Bestellungen aufbauen')
+def _sales_daily(conn):
+    # Stand der Abfrage in sales.py zum Zeitpunkt dieses Schritts; spätere
+    # Änderungen am Modul dürfen alte Schritte nicht verändern
+    conn.execute(text('DELETE FROM sales_daily'))
+    conn.execute(text("""
+        INSERT INTO sales_daily (article_id, day, quantity, revenue, last_sale)
+        SELECT order_item.article_id, date("order".created_at), sum(order_item.quantity),
+               sum(order_item.quantity * order_item.unit_price), max("order".created_at)
+        FROM order_item JOIN "order" ON "order".id = order_item.order_id
+        WHERE "order".status IN ('bezahlt', 'versendet')
+        GROUP BY order_item.article_id, date("order".created_at)
+    """))
+
+
+@migration(8, 'Volltextsuche (FTS5) für das Aktivitäts-Log')
+def _activity_log_fts(conn):
+    if conn.dialect.name == 'sqlite':
+        _create_fts(conn, 'activity_log', ['action'])
+
+
+@migration(9, 'Index für das Nachladen von Chat-Nachrichten nach id')
+def _message_id_index(conn):
+    # Chat: WHERE sender_id = ? AND receiver_id = ? AND id > ? ORDER BY id
+    _create_index(conn, 'ix_message_sender_receiver_id', 'message', 'sender_id', 'receiver_id', 'id')
+
+
+@migration(10, 'Index für die Chat-Übersicht nach Empfänger')
+def _message_receiver_index(conn):
+    # Übersicht: WHERE receiver_id = ? GROUP BY sender_id
+    _create_index(conn, 'ix_message_receiver_sender_id', 'message', 'receiver_id', 'sender_id', 'id')
+
+
+# Ausführung -------------------------------------------------------------------
+
+def current_version(conn) -> int:
+    return conn.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+
+
+def upgrade(engine, logger=None) -> int:
+    """Apply all pending steps in order and return the resulting version."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_version ('
+            'version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME)'
+        ))
+
+    version = 0
+    for step, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        try:
+            with engine.begin() as conn:
+                version = current_version(conn)
+                if step <= version:
+                    continue
+                func(conn)
+                conn.execute(
+                    text('INSERT INTO schema_version (version, description, applied_at) '
+                         'VALUES (:v, :d, :t)'),
+                    dict(v=step, d=description, t=datetime.utcnow()),
+                )
+                version = step
+        except IntegrityError:
+            # Ein parallel startender Prozess hat den Schritt bereits eingetragen;
+            # die eigene Ausführung wird verworfen, Schritte sind idempotent
+            version = step
+            continue
+        if logger:
+            logger.info('Schema-Migration %s angewendet: %s', step, description)
+    return version
@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy import func, literal_column
 from . import db, login_manager
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -30,39 +31,87 @@ class User(UserMixin, db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Zwischengespeicherte Identität statt einer Abfrage pro Request
+    from .identity import load_identity
+    return load_identity(user_id)
 
 
 class Article(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     sku = db.Column(db.String(64), unique=True, nullable=False)
-    category = db.Column(db.String(100), default='Sticker')
+    category = db.Column(db.String(100), default='Sticker', index=True)
     stock = db.Column(db.Integer, default=0)
     minimum_stock = db.Column(db.Integer, default=0)
     location_primary = db.Column(db.String(80))
     location_secondary = db.Column(db.String(80))
     image = db.Column(db.String(200))
     price = db.Column(db.Float, default=10.49)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     movements = db.relationship('Movement', backref='article', lazy=True, cascade='all, delete-orphan')
+    snapshots = db.relationship('StockSnapshot', backref='article', lazy=True, cascade='all, delete-orphan')
+
+
+# Sortierschlüssel der Artikelübersicht. Die Ausdrücke müssen exakt den
+# Ausdrucksindizes entsprechen (Literal statt Bind-Parameter), sonst kann
+# SQLite sie für ORDER BY nicht verwenden.
+ARTICLE_STOCK_KEY = func.coalesce(Article.stock, literal_column('0'))
+ARTICLE_DEFICIT_KEY = func.coalesce(Article.minimum_stock, literal_column('0')) - ARTICLE_STOCK_KEY
+ARTICLE_CATEGORY_KEY = func.coalesce(Article.category, literal_column("''"))
+
+db.Index('ix_article_name', Article.name)
+db.Index('ix_article_stock_key', ARTICLE_STOCK_KEY)
+db.Index('ix_article_deficit_key', ARTICLE_DEFICIT_KEY)
+db.Index('ix_article_category_key', ARTICLE_CATEGORY_KEY)
 
 
 class Movement(db.Model):
+    __table_args__ = (
+        db.Index('ix_movement_article_id_timestamp', 'article_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     article_id = db.Column(db.Integer, db.ForeignKey('article.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     note = db.Column(db.String(200))
     type = db.Column(db.String(20), default='Wareneingang', nullable=False)
-    invoice_number = db.Column(db.String(100))
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    invoice_number = db.Column(db.String(100), index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), index=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+class StockSnapshot(db.Model):
+    """Stock of an article at a reconciliation run.
+
+    ``last_movement_id`` is the highest movement id at that time, so the
+    movements booked afterwards can be found independently of their
+    (possibly backdated) timestamps. ``expected`` is the previous snapshot
+    plus those movements; a difference to ``stock`` is unexplained drift.
+    """
+    __table_args__ = (
+        db.Index('ix_stock_snapshot_article_id_taken_at', 'article_id', 'taken_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), nullable=False)
+    taken_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    stock = db.Column(db.Integer, nullable=False)
+    expected = db.Column(db.Integer)
+    last_movement_id = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def drift(self):
+        return None if self.expected is None else self.stock - self.expected
+
+
 class Order(db.Model):
+    __table_args__ = (
+        db.Index('ix_order_status_created_at', 'status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     customer_name = db.Column(db.String(120), nullable=False)
     customer_address = db.Column(db.String(200))
     status = db.Column(db.String(20), default='offen')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     movements = db.relationship('Movement', backref='order', lazy=True)
@@ -74,10 +123,11 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
-    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     article = db.relationship('Article')
 
@@ -104,7 +154,24 @@ class EndingCategory(db.Model):
     price = db.Column(db.Float, default=0.0)
     csv_multiplier = db.Column(db.Integer, default=1)
 
+class SalesDaily(db.Model):
+    """Sales of one article on one day, aggregated from paid and shipped orders."""
+    __table_args__ = (
+        db.Index('ix_sales_daily_day', 'day'),
+    )
+    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    last_sale = db.Column(db.DateTime)
+
+
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_sender_receiver_timestamp', 'sender_id', 'receiver_id', 'timestamp'),
+        db.Index('ix_message_sender_receiver_id', 'sender_id', 'receiver_id', 'id'),
+        db.Index('ix_message_receiver_sender_id', 'receiver_id', 'sender_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -114,9 +181,48 @@ class Message(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id])
     receiver = db.relationship('User', foreign_keys=[receiver_id])
 
+
+class ChatRead(db.Model):
+    """Read receipt: the newest message of *other* that *user* has seen."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_read_id = db.Column(db.Integer, nullable=False, default=0)
+
     
 class ActivityLog(db.Model):
+    __table_args__ = (
+        db.Index('ix_activity_log_user_id_timestamp', 'user_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     action = db.Column(db.String(255), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class Job(db.Model):
+    """Long running import or restore executed in the background."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default='wartend', nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    path = db.Column(db.String(255))
+    processed = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer)
+    errors = db.Column(db.Integer, default=0)
+    message = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def finished(self):
+        return self.status in ('fertig', 'fehlgeschlagen')
+
+    @property
+    def eta_seconds(self):
+        """Estimated remaining runtime based on the rows processed so far."""
+        if not self.started_at or not self.total or not self.processed or self.finished:
+            return None
+        elapsed = (datetime.utcnow() - self.started_at).total_seconds()
+        remaining = max(self.total - self.processed, 0)
+        return int(elapsed / self.processed * remaining)
@@ -0,0 +1,192 @@
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import event, tuple_
+from sqlalchemy.orm import Session
+
+
+# Keyset-Pagination -------------------------------------------------------------
+#
+# Statt OFFSET wird der Sortierschlüssel der letzten bzw. ersten Zeile einer
+# Seite als Cursor weitergegeben. Die nächste Seite startet per
+# ``WHERE (schluessel, id) > (:wert, :id)`` direkt an dieser Stelle im Index,
+# die Kosten sind daher unabhängig davon, wie weit geblättert wurde.
+
+def encode_cursor(values) -> str:
+    """Encode the key values of a row into an URL safe token."""
+    plain = [{'dt': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(plain).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str | None, types) -> list | None:
+    """Return the values of *token* or ``None`` for missing or invalid tokens.
+
+    *types* lists the expected type of every key value. A token with a
+    different number of values or other types, e.g. a stale link from another
+    sort order or an edited URL, counts as invalid and leads to the first page.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != len(types):
+        return None
+    decoded = []
+    for value, kind in zip(values, types):
+        if kind is datetime:
+            try:
+                value = datetime.fromisoformat(value['dt'])
+            except (ValueError, TypeError, KeyError):
+                return None
+        elif not isinstance(value, kind) or isinstance(value, bool):
+            return None
+        decoded.append(value)
+    return decoded
+
+
+class KeysetPage:
+    """One page of a keyset paginated query."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def page_size(default: int | None = None) -> int:
+    """Return the requested page size, limited to ``MAX_PAGE_SIZE``."""
+    default = default or current_app.config.get('PAGE_SIZE', 50)
+    size = request.args.get('per_page', default, type=int)
+    return max(1, min(size, current_app.config.get('MAX_PAGE_SIZE', 500)))
+
+
+def keyset_paginate(query, keys, per_page: int, after=None, before=None, descending=False, key_of=None):
+    """Return a :class:`KeysetPage` of *query* ordered by *keys*.
+
+    *keys* are column expressions forming a unique sort key, usually ending
+    with the primary key. *after* / *before* are decoded cursors. *key_of*
+    extracts the key values from a result row; by default the row's
+    attributes named like the key columns are used.
+    """
+    if key_of is None:
+        names = [k.key for k in keys]
+
+        def key_of(row):
+            return [getattr(row, name) for name in names]
+
+    # Cursor einer anderen Sortierung nicht an die Datenbank weiterreichen
+    if after is not None and len(after) != len(keys):
+        after = None
+    if before is not None and len(before) != len(keys):
+        before = None
+    key = tuple_(*keys)
+    backwards = before is not None and after is None
+    if after is not None:
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    elif before is not None:
+        query = query.filter(key > tuple_(*before) if descending else key < tuple_(*before))
+
+    # Rückwärts blättern: umgekehrt sortieren und das Ergebnis wieder drehen
+    reverse = descending != backwards
+    query = query.order_by(*[k.desc() if reverse else k.asc() for k in keys])
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage(rows)
+    first, last = encode_cursor(key_of(rows[0])), encode_cursor(key_of(rows[-1]))
+    if backwards:
+        return KeysetPage(rows, next_cursor=last, prev_cursor=first if more else None)
+    return KeysetPage(
+        rows,
+        next_cursor=last if more else None,
+        prev_cursor=first if (after is not None or before is not None) else None,
+    )
+
+
+# Gesamtanzahl ------------------------------------------------------------------
+#
+# ``COUNT(*)`` über gefilterte Tabellen ist bei jedem Seitenwechsel unnötig.
+# Ergebnisse werden pro Filterkombination ``COUNT_CACHE_SECONDS`` lang im
+# Prozess zwischengespeichert. Da die Schlüssel Suchbegriffe enthalten, werden
+# beim Eintragen abgelaufene Einträge verworfen und höchstens
+# ``COUNT_CACHE_MAX_ENTRIES`` Einträge behalten (die ältesten fliegen zuerst).
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+def cached_count(key, query) -> int:
+    """Return ``COUNT(*)`` of *query*, cached under *key*.
+
+    Changes through the ORM and the stock bookings in :mod:`app.ledger`
+    invalidate the counts of this process. Other bulk statements (imports,
+    restores) and writes of other processes show up after the TTL.
+    """
+    ttl = current_app.config.get('COUNT_CACHE_SECONDS', 30)
+    now = time.monotonic()
+    if ttl:
+        with _count_lock:
+            hit = _count_cache.get(key)
+        if hit and now - hit[0] < ttl:
+            return hit[1]
+    total = query.order_by(None).count()
+    if ttl:
+        limit = current_app.config.get('COUNT_CACHE_MAX_ENTRIES', 1000)
+        with _count_lock:
+            _count_cache.pop(key, None)
+            _count_cache[key] = (now, total)
+            if len(_count_cache) > limit:
+                for old in [k for k, (stamp, _) in _count_cache.items() if now - stamp >= ttl]:
+                    del _count_cache[old]
+                # Einfügereihenfolge: vorne stehen die ältesten Einträge
+                while len(_count_cache) > limit:
+                    del _count_cache[next(iter(_count_cache))]
+    return total
+
+
+def invalidate_counts(namespace=None) -> None:
+    """Drop cached counts, optionally only those whose key starts with *namespace*."""
+    with _count_lock:
+        if namespace is None:
+            _count_cache.clear()
+        else:
+            for key in [k for k in _count_cache if k[0] == namespace]:
+                del _count_cache[key]
+
+
+def invalidate_counts_on_change(model, namespace) -> None:
+    """Drop the counts of *namespace* whenever the ORM writes a *model* row.
+
+    Bulk statements bypass this; their changes show up after the TTL.
+    """
+    @event.listens_for(Session, 'after_flush')
+    def _invalidate(session, flush_context):
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, model):
+                invalidate_counts(namespace)
+                return
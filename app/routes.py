@@ -1,23 +1,30 @@
-import csv
-from io import StringIO
 from flask import (
     Blueprint,
     Response,
+    abort,
     current_app,
     flash,
     redirect,
     render_template,
     request,
+    send_from_directory,
     url_for,
     g,
+    jsonify,
+    stream_with_context,
 )
 from flask_login import current_user, login_required, login_user, logout_user
-from sqlalchemy import func
+from sqlalchemy import func, literal, select
 import os
 from werkzeug.utils import secure_filename
 
-from . import db
-from .models import User, Article, Movement, Order, OrderItem, Category, EndingCategory, Message, ActivityLog
+from . import activity, db
+from . import chat as chat_helpers
+from .models import (
+    User, Article, Movement, Order, OrderItem, Category, EndingCategory, Message, ActivityLog, Job,
+    StockSnapshot, SalesDaily, ChatRead,
+    ARTICLE_STOCK_KEY, ARTICLE_DEFICIT_KEY, ARTICLE_CATEGORY_KEY,
+)
 from .utils import (
     get_setting,
     set_setting,
@@ -27,15 +34,29 @@ from .utils import (
     get_category_prefixes,
     price_from_sku,
     price_from_suffix,
-    csv_multiplier_from_suffix,
     get_default_price,
     get_default_minimum_stock,
+    touch_reference_data,
     send_email,
     generate_reset_token,
     verify_reset_token,
 )
+from .jobs import enqueue
+from .pagination import cached_count, decode_cursor, invalidate_counts_on_change, keyset_paginate, page_size
+from .search import search_activity, search_articles, search_orders
+from .ledger import add_stock, drifting_articles, stock_at, take_stock
+from .sales import invoice_report, period_totals, touch_article_report
+from .exporter import (
+    ARTICLE_EXPORT_HEADER,
+    MOVEMENT_EXPORT_HEADER,
+    iter_csv,
+    iter_article_rows,
+    iter_movement_rows,
+    iter_backup_zip,
+    parse_date_range,
+)
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 
@@ -85,17 +106,47 @@ def log_activity(action: str) -> None:
         g.log_action = action
 
 
+@bp.app_errorhandler(413)
+def upload_too_large(error):
+    limit = current_app.config.get('MAX_CONTENT_LENGTH') or 0
+    flash(f'Datei zu groß (maximal {limit // (1024 * 1024)} MB).')
+    return redirect(request.path)
+
+
 @bp.after_app_request
 def log_user_action(response):
     action = getattr(g, 'log_action', None)
     if current_user.is_authenticated and action:
-        db.session.add(ActivityLog(user_id=current_user.id, action=action))
-        db.session.commit()
+        # Gepuffert, geschrieben wird gesammelt im Hintergrund (siehe activity.py)
+        activity.record(current_user.id, action)
     return response
 
 
 
 
+# Sortierungen der Artikelübersicht:
+# (Bezeichnung, Ausdruck, absteigend, Wert einer Zeile, Typ des Werts)
+ARTICLE_SORTS = {
+    'id': ('Anlage', Article.id, False, lambda a: a.id, int),
+    'name': ('Name', Article.name, False, lambda a: a.name, str),
+    'sku': ('SKU', Article.sku, False, lambda a: a.sku, str),
+    'stock': ('Bestand', ARTICLE_STOCK_KEY, False, lambda a: a.stock or 0, int),
+    'deficit': ('Fehlmenge', ARTICLE_DEFICIT_KEY, True, lambda a: (a.minimum_stock or 0) - (a.stock or 0), int),
+    'category': ('Kategorie', ARTICLE_CATEGORY_KEY, False, lambda a: a.category or '', str),
+}
+
+invalidate_counts_on_change(Article, 'articles')
+
+
+@bp.app_template_global()
+def url_with(**changes):
+    """Return the current URL with the given query arguments replaced."""
+    args = request.args.to_dict()
+    args.update(changes)
+    args = {k: v for k, v in args.items() if v not in (None, '')}
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
 @bp.route('/')
 def index():
     if user_management_enabled() and not current_user.is_authenticated:
@@ -103,7 +154,7 @@ def index():
     query = Article.query
     search = request.args.get('search')
     if search:
-        query = query.filter((Article.name.contains(search)) | (Article.sku.contains(search)))
+        query = search_articles(query, search)
     category = request.args.get('category')
     if category:
         query = query.filter_by(category=category)
@@ -116,9 +167,39 @@ def index():
             (Article.location_secondary == None) |
             (Article.location_secondary == '')
         )
-    articles = query.all()
+    total = cached_count(('articles', search, category, understock, no_secondary), query)
+
+    sort = request.args.get('sort', 'id')
+    if sort not in ARTICLE_SORTS:
+        sort = 'id'
+    _, key, descending, value_of, value_type = ARTICLE_SORTS[sort]
+    if request.args.get('dir') in ('asc', 'desc'):
+        descending = request.args.get('dir') == 'desc'
+    # (Sortierwert, id) ist eindeutig und dient als Cursor
+    if sort == 'id':
+        keys, key_of, types = [Article.id], lambda a: [a.id], (int,)
+    else:
+        keys, key_of, types = [key, Article.id], lambda a: [value_of(a), a.id], (value_type, int)
+    articles = keyset_paginate(
+        query,
+        keys,
+        page_size(),
+        after=decode_cursor(request.args.get('after'), types),
+        before=decode_cursor(request.args.get('before'), types),
+        descending=descending,
+        key_of=key_of,
+    )
     categories = get_categories()
-    return render_template('index.html', articles=articles, categories=categories, selected_category=category)
+    return render_template(
+        'index.html',
+        articles=articles,
+        categories=categories,
+        selected_category=category,
+        total=total,
+        sort=sort,
+        descending=descending,
+        sorts=ARTICLE_SORTS,
+    )
 
 @bp.route('/profiles')
 def select_profile():
@@ -216,27 +297,29 @@ def profile():
         gender = request.form.get('gender', '').strip()
         bio = request.form.get('bio', '').strip()
         file = request.files.get('profile_image')
+        # current_user ist nur eine zwischengespeicherte Identität, geändert wird die Zeile
+        user = db.session.get(User, current_user.id)
 
-        if username and username != current_user.username:
+        if username and username != user.username:
             if User.query.filter_by(username=username).first():
                 flash('Benutzername existiert bereits.')
                 return redirect(url_for('main.profile'))
-            current_user.username = username
+            user.username = username
 
-        if email and email != current_user.email:
+        if email and email != user.email:
             if User.query.filter_by(email=email).first():
                 flash('E-Mail existiert bereits.')
                 return redirect(url_for('main.profile'))
-            current_user.email = email
+            user.email = email
 
         if password:
-            current_user.set_password(password)
+            user.set_password(password)
 
         if name:
-            current_user.name = name
+            user.name = name
         if gender:
-            current_user.gender = gender
-        current_user.bio = bio
+            user.gender = gender
+        user.bio = bio
         if file and file.filename:
             filename = secure_filename(file.filename)
             folder = current_app.config['PROFILE_IMAGE_FOLDER']
@@ -248,7 +331,7 @@ def profile():
                 path = os.path.join(folder, filename)
                 counter += 1
             file.save(path)
-            current_user.profile_image = f"profile_pics/{filename}"
+            user.profile_image = f"profile_pics/{filename}"
 
 
         db.session.commit()
@@ -377,7 +460,62 @@ def delete_article(article_id):
 @login_optional
 def article_history(article_id):
     article = Article.query.get_or_404(article_id)
-    return render_template('history.html', article=article)
+    start, end = parse_date_range(request.args.get('start'), request.args.get('end'))
+    mtype = request.args.get('type')
+
+    # Bestand nach jeder Bewegung: aktueller Bestand minus alle späteren
+    # Bewegungen. Das Fenster läuft über alle Bewegungen des Artikels, die
+    # Filter wirken erst auf das Ergebnis.
+    newest_first = (Movement.timestamp.desc(), Movement.id.desc())
+    later = func.sum(Movement.quantity).over(order_by=newest_first, rows=(None, 0)) - Movement.quantity
+    history = (
+        select(
+            Movement.id, Movement.timestamp, Movement.quantity, Movement.type, Movement.note,
+            Movement.invoice_number, (literal(article.stock or 0) - later).label('balance'),
+        )
+        .where(Movement.article_id == article.id)
+        .subquery()
+    )
+    query = db.session.query(history)
+    if start:
+        query = query.filter(history.c.timestamp >= start)
+    if end:
+        query = query.filter(history.c.timestamp < end)
+    if mtype:
+        query = query.filter(history.c.type == mtype)
+    movements = keyset_paginate(
+        query,
+        [history.c.timestamp, history.c.id],
+        page_size(),
+        after=decode_cursor(request.args.get('after'), (datetime, int)),
+        before=decode_cursor(request.args.get('before'), (datetime, int)),
+        descending=True,
+    )
+
+    # Summen je Bewegungstyp im gewählten Zeitraum
+    totals = db.session.query(Movement.type, func.count(Movement.id), func.sum(Movement.quantity)).filter(
+        Movement.article_id == article.id
+    )
+    if start:
+        totals = totals.filter(Movement.timestamp >= start)
+    if end:
+        totals = totals.filter(Movement.timestamp < end)
+    totals = totals.group_by(Movement.type).order_by(Movement.type).all()
+
+    # Bestand zu einem Stichtag (Ende des Tages)
+    stock_on = None
+    _, at_end = parse_date_range(None, request.args.get('at'))
+    if at_end:
+        stock_on = stock_at(article, at_end - timedelta(microseconds=1))
+
+    return render_template(
+        'history.html',
+        article=article,
+        movements=movements,
+        totals=totals,
+        selected_type=mtype,
+        stock_on=stock_on,
+    )
 
 
 @bp.route('/movement/<int:article_id>/new', methods=['GET', 'POST'])
@@ -390,11 +528,11 @@ def new_movement(article_id):
         note = request.form.get('note')
         mtype = request.form.get('type', 'Wareneingang')
         movement = Movement(article_id=article.id, quantity=qty, note=note, type=mtype)
-        article.stock += qty
         db.session.add(movement)
+        stock = add_stock(article, qty)
         db.session.commit()
         log_activity(f'Bewegung {mtype} {qty} für {article.sku}')        
-        if article.stock < article.minimum_stock:
+        if stock < (article.minimum_stock or 0):
             flash('Bestand unter Mindestbestand!')
         flash('Bewegung erfasst')
         return redirect(url_for('main.article_history', article_id=article.id))
@@ -408,215 +546,142 @@ def new_movement(article_id):
 def import_csv():
     if request.method == 'POST':
         file = request.files['file']
-        raw = file.read()
-        try:
-            content = raw.decode('utf-8-sig')
-        except UnicodeDecodeError:
-            try:
-                content = raw.decode('latin1')
-            except UnicodeDecodeError:
-                flash('Datei konnte nicht gelesen werden. Bitte UTF-8 oder Latin1 codierte CSV verwenden.')
-                return redirect(url_for('main.import_csv'))
+        job = enqueue('article_import', file, _job_user_id())
+        return redirect(url_for('main.job_status', job_id=job.id))
 
-        stream = StringIO(content)
+    return render_template('import.html')
 
-        # Erst versuchen wir, das Standardformat zu lesen
-        reader = csv.DictReader(stream)
-        expected_fields = ['name', 'sku', 'stock', 'category', 'location_primary', 'location_secondary']
 
-        if reader.fieldnames == expected_fields:
-            mode = 'standard'
-        else:
-            stream.seek(0)
-            reader = csv.DictReader(stream, delimiter=';')
-            if 'Produktname' in (reader.fieldnames or []):
-                mode = 'lagerverwaltung'
-            else:
-                flash('Dateiformat nicht erkannt oder Spalten fehlen')
-                return redirect(url_for('main.import_csv'))
-
-        for row in reader:
-            if mode == 'lagerverwaltung':
-                sku = row.get('SKU')
-                name = row.get('Produktname')
-                stock = row.get('Lagerbestand (neu)')
-                minimum = row.get('Mindestbestand')
-                location_primary = row.get('Lagerplatz')
-                category = category_from_sku(sku) or 'Sonstiges'
-                location_secondary = ''
-            else:
-                sku = row['sku']
-                name = row['name']
-                stock = row['stock']
-                minimum = row.get('minimum_stock')
-                category = row['category']
-                location_primary = row.get('location_primary')
-                location_secondary = row.get('location_secondary')
-
-            article = Article.query.filter_by(sku=sku).first()
-            if not article:
-                article = Article(sku=sku)
-                db.session.add(article)
-
-            article.name = name
-            article.stock = int(stock) if stock not in (None, '') else 0
-            category = (category or '').strip()
-            if not category:
-                category = category_from_sku(sku) or 'Sticker'
-            article.category = category
-            article.location_primary = location_primary
-            article.location_secondary = location_secondary
-
-            price_raw = row.get('price', '').strip()
-            if price_raw:
-                try:
-                    article.price = float(price_raw.replace(',', '.'))
-                except ValueError:
-                    article.price = article.price  # Beibehalten, falls fehlerhaft
-            elif not article.price or article.price == 0:
-                # Nur wenn Preis nicht gesetzt, versuche Default
-                p = price_from_suffix(sku, article.category)
-                if p is None:
-                    p = price_from_sku(sku)
-                if p is None:
-                    p = get_default_price(article.category)
-                article.price = p or 0.0
 
 
-            try:
-                if minimum is not None and minimum != '':
-                    article.minimum_stock = int(minimum)
-                else:
-                    article.minimum_stock = get_default_minimum_stock(article.category)
-            except (ValueError, TypeError):
-                article.minimum_stock = get_default_minimum_stock(article.category)
 
-        db.session.commit()
-        log_activity('CSV-Import durchgeführt')        
-        flash('Import abgeschlossen')
-        return redirect(url_for('main.index'))
+# Hintergrund-Jobs -------------------------------------------------------------
+
+# Zielseiten nach Abschluss eines Jobs: (bei Erfolg, bei Fehler)
+JOB_PAGES = {
+    'article_import': ('main.index', 'main.import_csv'),
+    'invoice_import': ('main.inventory', 'main.inventory'),
+    'backup_import': ('main.index', 'main.backup_import'),
+    'stock_reconcile': ('main.settings_stock', 'main.settings_stock'),
+    'activity_prune': ('main.settings_logs', 'main.settings_logs'),
+}
+
+
+def _job_user_id():
+    return current_user.id if current_user.is_authenticated else None
+
+
+def _own_job_or_404(job_id):
+    """Return the job if it was started by the current user, else abort with 404.
+
+    Admins may look at every job; without user management there is no owner.
+    """
+    job = Job.query.get_or_404(job_id)
+    if current_app.config.get('ENABLE_USER_MANAGEMENT') and not current_user.is_admin:
+        if job.user_id != _job_user_id():
+            abort(404)
+    return job
 
-    return render_template('import.html')
 
+@bp.route('/jobs/<int:job_id>')
+@login_optional
+@staff_required
+def job_status(job_id):
+    job = _own_job_or_404(job_id)
+    if job.finished:
+        return redirect(url_for('main.job_result', job_id=job.id))
+    return render_template('job_status.html', job=job)
+
+
+@bp.route('/jobs/<int:job_id>/progress')
+@login_optional
+@staff_required
+def job_progress(job_id):
+    job = _own_job_or_404(job_id)
+    return jsonify(
+        status=job.status,
+        finished=job.finished,
+        processed=job.processed or 0,
+        total=job.total,
+        errors=job.errors or 0,
+        eta=job.eta_seconds,
+        result_url=url_for('main.job_result', job_id=job.id),
+    )
 
 
+@bp.route('/jobs/<int:job_id>/result')
+@login_optional
+@staff_required
+def job_result(job_id):
+    job = _own_job_or_404(job_id)
+    if not job.finished:
+        return redirect(url_for('main.job_status', job_id=job.id))
+    success, failure = JOB_PAGES.get(job.kind, ('main.index', 'main.index'))
+    if job.message:
+        flash(job.message)
+    return redirect(url_for(success if job.status == 'fertig' else failure))
 
 
 @bp.route('/export/articles')
 @login_optional
 def export_articles():
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['name', 'sku', 'stock', 'minimum_stock', 'category', 'location_primary', 'location_secondary'])
-    for a in Article.query.all():
-        writer.writerow([a.name, a.sku, a.stock, a.minimum_stock, a.category, a.location_primary, a.location_secondary])
-    output = si.getvalue()
-    return Response(output, mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=articles.csv'})
+    rows = iter_article_rows()
+    return Response(
+        stream_with_context(iter_csv(ARTICLE_EXPORT_HEADER, rows)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment;filename=articles.csv'},
+    )
 
 
 @bp.route('/backup/export')
 @login_optional
 def backup_export():
-    
-    """Export all articles and orders as a ZIP archive."""
-    import zipfile
-    from io import BytesIO
-
-    # Articles -------------------------------------------------------------
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow([
-        'sku', 'name', 'category', 'stock', 'minimum_stock',
-        'location_primary', 'location_secondary', 'image', 'price'
-    ])
-    for a in Article.query.all():
-        writer.writerow([
-            a.sku or '',
-            a.name or '',
-            a.category or '',
-            a.stock if a.stock is not None else 0,
-            a.minimum_stock if a.minimum_stock is not None else 0,
-            a.location_primary or '',
-            a.location_secondary or '',
-            a.image or '',
-            f"{a.price:.2f}" if a.price is not None else ''
-        ])
-    articles_csv = si.getvalue().encode('utf-8')
-
-    # Orders ---------------------------------------------------------------
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['id', 'customer_name', 'customer_address', 'status', 'created_at'])
-    for o in Order.query.all():
-        writer.writerow([
-            o.id,
-            o.customer_name or '',
-            o.customer_address or '',
-            o.status or '',
-            o.created_at.isoformat() if o.created_at else ''
-        ])
-    orders_csv = si.getvalue().encode('utf-8')
-
-    # Order items ----------------------------------------------------------
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['order_id', 'article_sku', 'quantity', 'unit_price'])
-    for item in OrderItem.query.all():
-        writer.writerow([
-            item.order_id,
-            item.article.sku if item.article else '',
-            item.quantity,
-            f"{item.unit_price:.2f}"
-        ])
-    items_csv = si.getvalue().encode('utf-8')
-
-    
-    # Invoice movements ----------------------------------------------------
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow([
-        'article_sku', 'article_name', 'quantity',
-        'type', 'note', 'timestamp', 'invoice_number'
-    ])
-    for m in Movement.query.filter(Movement.invoice_number != None).all():
-        writer.writerow([
-            m.article.sku if m.article else '',
-            m.article.name if m.article else '',
-            m.quantity,
-            m.type,
-            m.note or '',
-            m.timestamp.isoformat() if m.timestamp else '',
-            m.invoice_number or ''
-        ])
-    invoices_csv = si.getvalue().encode('utf-8')
-
-
-    # Build ZIP ------------------------------------------------------------
-    mem = BytesIO()
-    with zipfile.ZipFile(mem, 'w', zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr('articles.csv', articles_csv)
-        zf.writestr('orders.csv', orders_csv)
-        zf.writestr('order_items.csv', items_csv)
-        zf.writestr('invoice_movements.csv', invoices_csv)
-    mem.seek(0)
+    """Export all articles and orders as a ZIP archive.
+
+    ``?mode=incremental`` exports only rows changed since the last backup,
+    ``?since=<ISO-Zeitpunkt>`` since the ``created_at`` of a given manifest.
+    """
+    created_at = datetime.utcnow()
+    raw_since = request.args.get('since', '').strip()
+    if not raw_since and request.args.get('mode') == 'incremental':
+        raw_since = get_setting('last_backup_at', '')
+    since = None
+    if raw_since:
+        try:
+            since = datetime.fromisoformat(raw_since)
+        except ValueError:
+            flash('Ungültiger Zeitpunkt für inkrementelles Backup')
+            return redirect(url_for('main.index'))
+        # Zeilen, die vor dem letzten Backup geschrieben, aber erst nach dessen
+        # Lese-Snapshot committet wurden, tragen ein älteres updated_at. Das
+        # Delta überlappt daher; doppelt exportierte Zeilen sind beim Import
+        # harmlos.
+        since -= timedelta(seconds=current_app.config['BACKUP_OVERLAP_SECONDS'])
+
+    def generate():
+        yield from iter_backup_zip(created_at, since)
+        # Erst nach vollständiger Auslieferung als Basis für das nächste Delta merken
+        set_setting('last_backup_at', created_at.isoformat())
+
+    suffix = '_inkrementell' if since else ''
     return Response(
-        mem.read(),
+        stream_with_context(generate()),
         mimetype='application/zip',
-        headers={'Content-Disposition': 'attachment;filename=backup.zip'}
+        headers={'Content-Disposition': f'attachment;filename=backup_{created_at:%Y%m%d_%H%M%S}{suffix}.zip'}
     )
 
 
-
 @bp.route('/export/movements')
 @login_optional
 def export_movements():
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['article_sku','article_name', 'quantity', 'type', 'note', 'timestamp', 'invoice_number'])
-    for m in Movement.query.all():
-        writer.writerow([m.article.sku, m.article.name, m.quantity, m.type, m.note, m.timestamp, m.invoice_number or ''])
-    output = si.getvalue()
-    return Response(output, mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=movements.csv'})
+    """Stream movements as CSV, optionally filtered by ``start``, ``end`` and ``type``."""
+    start, end = parse_date_range(request.args.get('start'), request.args.get('end'))
+    rows = iter_movement_rows(start, end, request.args.get('type') or None)
+    return Response(
+        stream_with_context(iter_csv(MOVEMENT_EXPORT_HEADER, rows)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment;filename=movements.csv'},
+    )
 
 @bp.route('/backup/import', methods=['GET', 'POST'])
 @login_optional
@@ -629,195 +694,8 @@ def backup_import():
             flash('Keine Datei ausgewählt')
             return redirect(url_for('main.backup_import'))
         
-        import zipfile
-        from io import BytesIO
-        raw = file.read()
-        def decode_bytes(data: bytes) -> str | None:
-            for enc in ('utf-8-sig', 'latin1'):
-                try:
-                    return data.decode(enc)
-                except UnicodeDecodeError:
-                    continue
-            return None
-
-        articles_text = None
-        orders_text = None
-        items_text = None
-        invoices_text = None
-
-        if zipfile.is_zipfile(BytesIO(raw)):
-            with zipfile.ZipFile(BytesIO(raw)) as zf:
-                try:
-                    articles_text = decode_bytes(zf.read('articles.csv'))
-                    orders_text = decode_bytes(zf.read('orders.csv'))
-                    items_text = decode_bytes(zf.read('order_items.csv'))
-                    try:
-                        invoices_text = decode_bytes(
-                            zf.read('invoice_movements.csv')
-                        )
-                    except KeyError:
-                        invoices_text = None
-                except KeyError:
-                    flash('Backup-Datei unvollständig')
-                    return redirect(url_for('main.backup_import'))
-        else:
-            articles_text = decode_bytes(raw)
-
-        if articles_text is None:
-            flash('Datei konnte nicht gelesen werden.')
-            return redirect(url_for('main.backup_import'))
-
-        reader = csv.DictReader(StringIO(articles_text))
-        required = {
-            'sku', 'name', 'category', 'stock', 'minimum_stock',
-            'location_primary', 'location_secondary', 'image', 'price'
-        }
-        if not reader.fieldnames or not required.issubset(set(reader.fieldnames)):
-            flash('Ungültiges Format der Backup-Datei')
-            return redirect(url_for('main.backup_import'))
-
-        for row in reader:
-            sku = (row.get('sku') or '').strip()
-            if not sku:
-                continue
-            article = Article.query.filter_by(sku=sku).first()
-            if not article:
-                article = Article(sku=sku)
-                db.session.add(article)
-
-            article.name = row.get('name') or ''
-            article.category = (row.get('category') or 'Sticker').strip() or 'Sticker'
-
-            try:
-                article.stock = int(row.get('stock') or 0)
-            except ValueError:
-                article.stock = 0
-
-            try:
-                article.minimum_stock = int(row.get('minimum_stock') or 0)
-            except ValueError:
-                article.minimum_stock = 0
-
-            article.location_primary = row.get('location_primary') or ''
-            article.location_secondary = row.get('location_secondary') or ''
-            article.image = row.get('image') or ''
-
-            price_raw = row.get('price', '').strip()
-            if price_raw:
-                try:
-                    article.price = float(price_raw.replace(',', '.'))
-                except ValueError:
-                    article.price = article.price  # Behalte alten Preis
-            elif not article.price or article.price == 0:
-                p = price_from_suffix(sku, article.category)
-                if p is None:
-                    p = price_from_sku(sku)
-                if p is None:
-                    p = get_default_price(article.category)
-                article.price = p or 0.0
-
-
-         # Orders -----------------------------------------------------------
-        from datetime import datetime
-        orders_mapping = {}
-        if orders_text:
-            r = csv.DictReader(StringIO(orders_text))
-            fields = {'id', 'customer_name', 'customer_address', 'status', 'created_at'}
-            if not r.fieldnames or not fields.issubset(set(r.fieldnames)):
-                flash('Ungültiges Format der Orders-Datei')
-                return redirect(url_for('main.backup_import'))
-            for row in r:
-                try:
-                    oid = int(row.get('id') or 0)
-                except ValueError:
-                    continue
-                if oid <= 0:
-                    continue
-                order = Order.query.get(oid)
-                if not order:
-                    order = Order(id=oid)
-                    db.session.add(order)
-                else:
-                    # remove existing items
-                    for it in order.items:
-                        db.session.delete(it)
-                order.customer_name = row.get('customer_name') or ''
-                order.customer_address = row.get('customer_address') or ''
-                order.status = row.get('status') or 'offen'
-                ts = row.get('created_at')
-                try:
-                    order.created_at = datetime.fromisoformat(ts) if ts else datetime.utcnow()
-                except ValueError:
-                    order.created_at = datetime.utcnow()
-                orders_mapping[oid] = order
-
-        # Order items ------------------------------------------------------
-        if items_text:
-            r = csv.DictReader(StringIO(items_text))
-            fields = {'order_id', 'article_sku', 'quantity', 'unit_price'}
-            if not r.fieldnames or not fields.issubset(set(r.fieldnames)):
-                flash('Ungültiges Format der Order-Items-Datei')
-                return redirect(url_for('main.backup_import'))
-            for row in r:
-                try:
-                    oid = int(row.get('order_id') or 0)
-                    qty = int(row.get('quantity') or 0)
-                    price = float(row.get('unit_price') or 0)
-                except ValueError:
-                    continue
-                sku = (row.get('article_sku') or '').strip()
-                if oid not in orders_mapping:
-                    continue
-                article = Article.query.filter_by(sku=sku).first()
-                if not article:
-                    continue
-                item = OrderItem(order_id=oid, article_id=article.id,
-                                 quantity=qty, unit_price=price)
-                db.session.add(item)
-
-
-        # Invoice movements -------------------------------------------------
-        if invoices_text:
-            r = csv.DictReader(StringIO(invoices_text))
-            fields = {
-                'article_sku', 'quantity', 'type',
-                'note', 'timestamp', 'invoice_number'
-            }
-            if not r.fieldnames or not fields.issubset(set(r.fieldnames)):
-                flash('Ungültiges Format der Invoice-Movements-Datei')
-                return redirect(url_for('main.backup_import'))
-            from datetime import datetime
-            for row in r:
-                sku = (row.get('article_sku') or '').strip()
-                if not sku:
-                    continue
-                article = Article.query.filter_by(sku=sku).first()
-                if not article:
-                    continue
-                try:
-                    qty = int(row.get('quantity') or 0)
-                except ValueError:
-                    qty = 0
-                t = row.get('timestamp') or ''
-                try:
-                    ts = datetime.fromisoformat(t) if t else datetime.utcnow()
-                except ValueError:
-                    ts = datetime.utcnow()
-                m = Movement(
-                    article_id=article.id,
-                    quantity=qty,
-                    type=row.get('type') or 'Warenausgang',
-                    note=row.get('note') or '',
-                    timestamp=ts,
-                    invoice_number=(row.get('invoice_number') or None),
-                )
-                db.session.add(m)
-
-
-        db.session.commit()
-        log_activity('Backup importiert')        
-        flash('Backup importiert')
-        return redirect(url_for('main.index'))
+        job = enqueue('backup_import', file, _job_user_id())
+        return redirect(url_for('main.job_status', job_id=job.id))
 
     return render_template('backup_import.html')
 
@@ -830,31 +708,70 @@ def invoices():
     movements = Movement.query.filter(Movement.invoice_number != None).order_by(Movement.timestamp.desc()).all()
     return render_template('invoices.html', movements=movements)
 
+ANALYSIS_SORTS = {
+    'revenue': func.sum(SalesDaily.revenue),
+    'quantity': func.sum(SalesDaily.quantity),
+    'date': func.max(SalesDaily.last_sale),
+}
+ANALYSIS_SORT_COLUMNS = {'revenue': 'revenue', 'quantity': 'quantity', 'date': 'last_date'}
+
+
 @bp.route('/analysis')
 @login_optional
 @admin_required
 def analysis():
     sort = request.args.get('sort', 'revenue')
+    if sort not in ANALYSIS_SORTS:
+        sort = 'revenue'
+    start, end = parse_date_range(request.args.get('start'), request.args.get('end'))
+    start, end = (start.date() if start else None), (end.date() if end else None)
+    limit = page_size()
+
+    # Gelesen wird aus der Tagesstatistik ``sales_daily`` (siehe sales.py),
+    # sortiert und begrenzt wird in SQL. Zeilen gelöschter Artikel zählen
+    # weder in der Tabelle noch in den Summen.
+    query = db.session.query(
+        SalesDaily.article_id.label('id'),
+        func.sum(SalesDaily.quantity).label('quantity'),
+        func.sum(SalesDaily.revenue).label('revenue'),
+        func.max(SalesDaily.last_sale).label('last_date'),
+    ).join(Article, Article.id == SalesDaily.article_id)
+    if start:
+        query = query.filter(SalesDaily.day >= start)
+    if end:
+        query = query.filter(SalesDaily.day < end)
+    overall = query.with_entities(
+        func.coalesce(func.sum(SalesDaily.quantity), 0), func.coalesce(func.sum(SalesDaily.revenue), 0)
+    ).one()
+    ranked = (
+        query.group_by(SalesDaily.article_id)
+        .order_by(ANALYSIS_SORTS[sort].desc(), SalesDaily.article_id)
+        .limit(limit)
+        .subquery()
+    )
     results = (
-        db.session.query(
-            Article.name.label('name'),
-            func.sum(OrderItem.quantity).label('quantity'),
-            func.sum(OrderItem.quantity * OrderItem.unit_price).label('revenue'),
-            func.max(Order.created_at).label('last_date'),            
-        )
-        .join(OrderItem, Article.id == OrderItem.article_id)
-        .join(Order, Order.id == OrderItem.order_id)
-        .filter(Order.status.in_(['bezahlt', 'versendet']))
-        .group_by(Article.id)
+        db.session.query(ranked, Article.name.label('name'))
+        .join(Article, Article.id == ranked.c.id)
+        .order_by(ranked.c[ANALYSIS_SORT_COLUMNS[sort]].desc(), ranked.c.id)
         .all()
     )
-    if sort == 'quantity':
-        results.sort(key=lambda r: r.quantity or 0, reverse=True)
-    elif sort == 'date':
-        results.sort(key=lambda r: r.last_date or datetime.min, reverse=True)        
-    else:
-        results.sort(key=lambda r: r.revenue or 0, reverse=True)
-    return render_template('analysis.html', data=results, sort=sort)
+
+    # Vergleich mit dem unmittelbar vorhergehenden, gleich langen Zeitraum
+    compare = bool(request.args.get('compare')) and bool(start and end)
+    previous = previous_total = prev_range = None
+    if compare:
+        prev_start, prev_end = start - (end - start), start
+        prev_range = (prev_start, prev_end - timedelta(days=1))
+        previous = period_totals(prev_start, prev_end, [r.id for r in results])
+        previous_total = db.session.query(
+            func.coalesce(func.sum(SalesDaily.quantity), 0), func.coalesce(func.sum(SalesDaily.revenue), 0)
+        ).join(Article, Article.id == SalesDaily.article_id).filter(
+            SalesDaily.day >= prev_start, SalesDaily.day < prev_end
+        ).one()
+    return render_template(
+        'analysis.html', data=results, sort=sort, total=overall, compare=compare,
+        previous=previous, previous_total=previous_total, prev_range=prev_range,
+    )
 
 @bp.route('/analysis/invoices')
 @login_optional
@@ -862,44 +779,7 @@ def analysis():
 def invoice_analysis():
     """Show statistics for all invoiced movements grouped by article SKU."""
     sort = request.args.get('sort', 'sku')
-
-    query_results = (
-        db.session.query(
-            Article.id.label('id'),
-            Article.name.label('name'),
-            Article.sku.label('sku'),
-            Article.category.label('category'),
-            Article.price.label('price'),
-            func.sum(func.abs(Movement.quantity)).label('quantity'),
-        )
-        .join(Article, Movement.article_id == Article.id)
-        .filter(Movement.invoice_number != None)
-        .group_by(Article.id)
-        .all()
-    )
-
-    data = []
-    for r in query_results:
-        multiplier = csv_multiplier_from_suffix(r.sku, r.category)
-        # Fallback für Sticker-Kategorie
-        if multiplier is None and r.category and r.category.strip().lower() == 'sticker':
-            multiplier = int(get_setting('sticker_csv_multiplier', '100') or '100')
-        # Absicherung gegen fehlerhafte Werte
-        if not multiplier or multiplier < 1:
-            multiplier = 1
-        quantity = r.quantity/multiplier
-        revenue = r.price * quantity
-        data.append(
-            dict(name=r.name, sku=r.sku, quantity=r.quantity, revenue=revenue)
-        )
-    if sort == 'quantity':
-        data.sort(key=lambda x: x['quantity'] or 0, reverse=True)
-    elif sort == 'revenue':
-        data.sort(key=lambda x: x['revenue'] or 0, reverse=True)
-    else:  # 'sku'
-        data.sort(key=lambda x: x['sku'] or '')
-
-    return render_template('invoice_analysis.html', data=data, sort=sort)
+    return render_template('invoice_analysis.html', data=invoice_report(sort), sort=sort)
 
 
 
@@ -912,9 +792,8 @@ def inventory():
     # Suche verarbeiten
     search = request.args.get('search')
     if search:
-        query = query.filter(
-            (Article.name.contains(search)) | (Article.sku.contains(search))
-        )
+        # Treffer nach Relevanz sortiert
+        query = search_articles(query, search, ranked=True)
 
     # Kategorie-Filter mit Trim aus URL + DB
     category = request.args.get('category')
@@ -927,100 +806,8 @@ def inventory():
     if request.method == 'POST' and 'search' not in request.form:
         file = request.files.get('file')
         if file and file.filename:
-            adjusted = 0
-            data = file.read()
-
-            # Encoding prüfen und Text dekodieren
-            text = None
-            for enc in ('utf-8-sig', 'latin1'):
-                try:
-                    text = data.decode(enc)
-                    break
-                except UnicodeDecodeError:
-                    continue
-
-            if text is None:
-                flash('Datei konnte nicht verarbeitet werden (Encoding).')
-                return redirect(url_for('main.inventory'))
-
-            reader = csv.DictReader(StringIO(text), delimiter=';')
-            invoice_field = None
-            for f in ('Rechnung', 'Rechennummer', 'Dokument: Dokumentnummer'):
-                if f in reader.fieldnames:
-                    invoice_field = f
-                    break
-
-            date_field = None
-            for f in reader.fieldnames:
-                lf = f.lower()
-                if 'datum' in lf or 'date' in lf:
-                    date_field = f
-                    if 'bestell' in lf or 'dokument' in lf or lf == 'datum' or lf == 'date':
-                        break
-
-            if 'Posten: Artikelnummer' not in reader.fieldnames or 'Posten: Anzahl' not in reader.fieldnames:
-                flash('Erforderliche Spalten fehlen.')
-                return redirect(url_for('main.inventory'))
-
-            try:
-                for row in reader:
-                    sku = row.get('Posten: Artikelnummer', '').strip()
-                    qty = row.get('Posten: Anzahl', '').strip()
-                    invoice = row.get(invoice_field, '').strip() if invoice_field else None
-                    date_str = row.get(date_field, '').strip() if date_field else ''
-                    ts = None
-                    if date_str:
-                        for fmt in ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
-                            try:
-                                ts = datetime.strptime(date_str, fmt)
-                                break
-                            except ValueError:
-                                continue
-                        if ts is None:
-                            try:
-                                ts = datetime.fromisoformat(date_str)
-                            except ValueError:
-                                ts = None
-                    if not sku or not qty:
-                        continue
-                    try:
-                        qty = int(qty)
-                    except ValueError:
-                        continue
-
-                    article = Article.query.filter_by(sku=sku).first()
-                    if not article:
-                        continue
-
-                    multiplier = csv_multiplier_from_suffix(article.sku, article.category)
-                    if multiplier is None and article.category and article.category.strip().lower() == 'sticker':
-                        multiplier = int(get_setting('sticker_csv_multiplier', '100') or '100')
-                    if multiplier and multiplier != 1:
-                        current_app.logger.info(f"[IMPORT] Multiplier f\u00fcr Sticker/Endung: {multiplier}")
-                        qty *= multiplier
-
-                    article.stock -= qty
-                    db.session.add(Movement(
-                        article_id=article.id,
-                        quantity=-qty,
-                        type='Warenausgang',
-                        invoice_number=invoice if invoice else None,
-                        note='Import Export-Datei',
-                        timestamp=ts if ts else datetime.utcnow()
-                    ))
-                    adjusted += 1
-            except Exception as e:
-                flash('Fehler beim Verarbeiten der Datei.')
-                return redirect(url_for('main.inventory'))
-
-            if adjusted:
-                db.session.commit()
-                log_activity(f'Inventur-CSV importiert – {adjusted} Artikel angepasst')                
-                flash(f'CSV-Import abgeschlossen – {adjusted} Artikel angepasst.')
-            else:
-                flash('CSV-Import abgeschlossen – Keine passenden Artikel gefunden.')
-
-            return redirect(url_for('main.inventory'))
+            job = enqueue('invoice_import', file, _job_user_id())
+            return redirect(url_for('main.job_status', job_id=job.id))
 
     # WICHTIG: articles immer definieren, wenn kein Redirect/Return vorher ausgeführt wurde
     articles = query.all()
@@ -1046,7 +833,7 @@ def order_list():
         query = query.filter_by(status=status)
     customer = request.args.get('customer')
     if customer:
-        query = query.filter(Order.customer_name.contains(customer))
+        query = search_orders(query, customer)
     start = request.args.get('start')
     if start:
         try:
@@ -1061,9 +848,31 @@ def order_list():
             query = query.filter(Order.created_at <= end_dt)
         except ValueError:
             pass
-    orders = query.order_by(Order.created_at.desc()).all()
+    orders = keyset_paginate(
+        query,
+        [Order.created_at, Order.id],
+        page_size(),
+        after=decode_cursor(request.args.get('after'), (datetime, int)),
+        before=decode_cursor(request.args.get('before'), (datetime, int)),
+        descending=True,
+    )
+
+    # Summen und Positionen aller Bestellungen der Seite in einer Abfrage
+    totals = {}
+    if orders.items:
+        rows = (
+            db.session.query(
+                OrderItem.order_id,
+                func.sum(OrderItem.quantity * OrderItem.unit_price),
+                func.count(OrderItem.id),
+            )
+            .filter(OrderItem.order_id.in_([o.id for o in orders]))
+            .group_by(OrderItem.order_id)
+        )
+        totals = {order_id: (total, count) for order_id, total, count in rows}
+
     statuses = ['offen', 'bezahlt', 'versendet']
-    return render_template('orders_list.html', orders=orders, statuses=statuses, selected_status=status)
+    return render_template('orders_list.html', orders=orders, totals=totals, statuses=statuses, selected_status=status)
 
 
 @bp.route('/orders/<int:order_id>')
@@ -1147,7 +956,6 @@ def order_label(order_id):
 @staff_required
 def new_order():
     statuses = ['offen', 'bezahlt', 'versendet']
-    articles = Article.query.all()
     if request.method == 'POST':
         street = request.form.get('customer_street', '')
         city_zip = request.form.get('customer_city_zip', '')
@@ -1157,26 +965,36 @@ def new_order():
                       status=request.form['status'])
         db.session.add(order)
         db.session.flush()
+
+        # Nur die bestellten Artikel laden statt aller Artikel
+        quantities = {}
+        for key, value in request.form.items():
+            if key.startswith('qty_') and key[4:].isdigit():
+                qty = int(value or 0)
+                if qty > 0:
+                    quantities[int(key[4:])] = qty
+        articles = Article.query.filter(Article.id.in_(list(quantities))).order_by(Article.id).all()
+
         movements = []
         for article in articles:
-            qty = int(request.form.get(f'qty_{article.id}', 0))
+            qty = quantities[article.id]
             price = float(request.form.get(f'price_{article.id}', 0) or 0)
-            if qty > 0:
-                if order.status in ['offen', 'bezahlt'] and article.stock - qty < 0:
-                    db.session.rollback()
-                    flash(f'Nicht genug Bestand für {article.name}')
-                    return redirect(url_for('main.new_order'))
-                item = OrderItem(order_id=order.id, article_id=article.id, quantity=qty, unit_price=price)
-                db.session.add(item)
-                if order.status in ['offen', 'bezahlt']:
-                    article.stock -= qty
-                    movements.append(Movement(article_id=article.id, quantity=-qty, note=f'Bestellung #{order.id}', order_id=order.id, type='Warenausgang'))
+            # Bedingtes UPDATE: schlägt fehl statt zu überverkaufen
+            if order.status in ['offen', 'bezahlt'] and not take_stock(article, qty):
+                db.session.rollback()
+                flash(f'Nicht genug Bestand für {article.name}')
+                return redirect(url_for('main.new_order'))
+            item = OrderItem(order_id=order.id, article_id=article.id, quantity=qty, unit_price=price)
+            db.session.add(item)
+            if order.status in ['offen', 'bezahlt']:
+                movements.append(Movement(article_id=article.id, quantity=-qty, note=f'Bestellung #{order.id}', order_id=order.id, type='Warenausgang'))
         for m in movements:
             db.session.add(m)
         db.session.commit()
         log_activity(f'Bestellung {order.id} angelegt')        
         flash('Bestellung angelegt')
         return redirect(url_for('main.order_detail', order_id=order.id))
+    articles = Article.query.all()
     return render_template('order_form.html', articles=articles, statuses=statuses,
                            addr_street='', addr_city_zip='')
 
@@ -1250,26 +1068,40 @@ def settings_cleanup():
         flash('Falsches Passwort.')
         return redirect(url_for('main.settings_general'))
 
+    # Ohne Bewegungen sind die Snapshots des Bestandsabgleichs wertlos
     if option == 'orders':
+        SalesDaily.query.delete()
+        StockSnapshot.query.delete()
         Movement.query.delete()
         OrderItem.query.delete()
         Order.query.delete()
+        # Bulk-Delete umgeht die Session-Events
+        touch_article_report()
         db.session.commit()
         log_activity('Alle Bestellungen gelöscht')        
         flash('Alle Bestellungen gelöscht.')
     elif option == 'articles':
+        SalesDaily.query.delete()
+        StockSnapshot.query.delete()
         Movement.query.delete()
         OrderItem.query.delete()
         Article.query.delete()
+        # Bulk-Delete umgeht die Session-Events
+        touch_article_report()
         db.session.commit()
         log_activity('Alle Artikel gelöscht')        
         flash('Alle Artikel gelöscht.')
     elif option == 'all':
+        SalesDaily.query.delete()
+        StockSnapshot.query.delete()
         Movement.query.delete()
         OrderItem.query.delete()
         Order.query.delete()
         Article.query.delete()
         Category.query.delete()
+        # Bulk-Delete umgeht die Session-Events
+        touch_reference_data()
+        touch_article_report()
         db.session.commit()
         log_activity('Datenbank bereinigt')        
         flash('Datenbank bereinigt.')
@@ -1332,6 +1164,7 @@ def edit_category(category_id):
             category.name = name
             # Update articles using old category name
             Article.query.filter_by(category=old_name).update({'category': name})
+            touch_article_report()
         category.prefix = prefix
         try:
             category.default_price = float(price_raw) if price_raw else 0.0
@@ -1357,6 +1190,7 @@ def apply_category_defaults(category_id):
         'price': category.default_price,
         'minimum_stock': category.default_min_stock,
     })
+    touch_article_report()
     db.session.commit()
     log_activity(f'Standardwerte für Kategorie {category.name} angewendet')    
     flash('Standardwerte auf Artikel angewendet')
@@ -1457,6 +1291,7 @@ def apply_ending_price(ending_id):
             Article.category == ending.category,
             Article.sku.like(f"%{ending.suffix}")
         ).update({'price': price})
+        touch_article_report()
         db.session.commit()
         log_activity(f'Preis-Endung {ending.suffix} angewendet')        
         flash('Preis auf Artikel angewendet')
@@ -1476,19 +1311,98 @@ def delete_ending(ending_id):
     return redirect(url_for('main.settings_endings'))
 
 
+# Bestandsabgleich -------------------------------------------------------------
+
+@bp.route('/settings/stock')
+@login_optional
+@admin_required
+def settings_stock():
+    """Show the last reconciliation run and articles whose stock drifted."""
+    last_run = db.session.query(func.max(StockSnapshot.taken_at)).scalar()
+    return render_template('settings_stock.html', last_run=last_run, drifting=drifting_articles())
+
+
+@bp.route('/settings/stock/reconcile', methods=['POST'])
+@login_optional
+@admin_required
+def settings_stock_reconcile():
+    job = enqueue('stock_reconcile', user_id=_job_user_id())
+    return redirect(url_for('main.job_status', job_id=job.id))
+
+
+# Datenbank ------------------------------------------------------------------
+
+@bp.route('/settings/database')
+@login_optional
+@admin_required
+def settings_database():
+    """Show the database URI and the SQLite pragmas in effect."""
+    from sqlalchemy import text
+    from .database import active_pragmas
+
+    url = db.engine.url.render_as_string(hide_password=True)
+    schema_version = db.session.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+    sqlite_version = None
+    if db.engine.dialect.name == 'sqlite':
+        sqlite_version = db.session.execute(text('SELECT sqlite_version()')).scalar()
+    return render_template(
+        'settings_database.html',
+        url=url,
+        schema_version=schema_version,
+        sqlite_version=sqlite_version,
+        pragmas=active_pragmas(),
+        configured=current_app.config.get('SQLITE_PRAGMAS', {}),
+        engine_options=current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    )
+
+
 # Aktivitäts-Log -------------------------------------------------------------
 
 @bp.route('/settings/logs')
 @login_optional
 @admin_required
 def settings_logs():
+    activity.flush()
     user_id = request.args.get('user_id', type=int)
-    users = User.query.all()
-    query = ActivityLog.query.order_by(ActivityLog.timestamp.desc())
+    search = request.args.get('q', '').strip()
+    start, end = parse_date_range(request.args.get('start'), request.args.get('end'))
+    users = User.query.order_by(User.username).all()
+    query = ActivityLog.query
     if user_id:
         query = query.filter_by(user_id=user_id)
-    logs = query.limit(100).all()
-    return render_template('settings_logs.html', logs=logs, users=users, selected_user_id=user_id)
+    if search:
+        query = search_activity(query, search)
+    if start:
+        query = query.filter(ActivityLog.timestamp >= start)
+    if end:
+        query = query.filter(ActivityLog.timestamp < end)
+    logs = keyset_paginate(
+        query,
+        [ActivityLog.timestamp, ActivityLog.id],
+        page_size(),
+        after=decode_cursor(request.args.get('after'), (datetime, int)),
+        before=decode_cursor(request.args.get('before'), (datetime, int)),
+        descending=True,
+    )
+    return render_template(
+        'settings_logs.html', logs=logs, users=users, selected_user_id=user_id, search=search,
+        archives=activity.list_archives(), retention_days=current_app.config['ACTIVITY_LOG_RETENTION_DAYS'],
+    )
+
+
+@bp.route('/settings/logs/prune', methods=['POST'])
+@login_optional
+@admin_required
+def settings_logs_prune():
+    job = enqueue('activity_prune', user_id=_job_user_id())
+    return redirect(url_for('main.job_status', job_id=job.id))
+
+
+@bp.route('/settings/logs/archive/<path:filename>')
+@login_optional
+@admin_required
+def settings_logs_archive(filename):
+    return send_from_directory(activity.archive_folder(), filename, as_attachment=True)
 
 
 
@@ -1621,6 +1535,7 @@ def delete_user(user_id):
     if user.is_admin and User.query.filter_by(is_admin=True).count() <= 1:
         flash('Mindestens ein Admin-Benutzer muss bestehen bleiben.')
         return redirect(url_for('main.settings_users'))
+    ChatRead.query.filter((ChatRead.user_id == user.id) | (ChatRead.other_id == user.id)).delete()
     db.session.delete(user)
     db.session.commit()
     log_activity(f'Benutzer {user.username} gelöscht')    
@@ -1634,7 +1549,8 @@ def social():
     if not user_management_enabled():
         return redirect(url_for('main.index'))
     users = User.query.all()
-    return render_template('social.html', users=users)
+    conversations = chat_helpers.conversations(current_user.id) if current_user.is_authenticated else []
+    return render_template('social.html', users=users, conversations=conversations)
 
 
 @bp.route('/social/<int:user_id>', methods=['GET', 'POST'])
@@ -1644,15 +1560,61 @@ def chat(user_id):
         return redirect(url_for('main.index'))
     other = User.query.get_or_404(user_id)
     if request.method == 'POST' and current_user.is_authenticated:
-        content = request.form.get('message', '').strip()
-        if content:
-            msg = Message(sender_id=current_user.id, receiver_id=other.id, content=content)
-            db.session.add(msg)
-            db.session.commit()
-            log_activity(f'Nachricht an {other.username} gesendet')            
+        # Fallback ohne JavaScript, der Chat sendet sonst über chat_messages
+        if _send_message(other):
             return redirect(url_for('main.chat', user_id=other.id))
-    messages = Message.query.filter(
-        ((Message.sender_id == current_user.id) & (Message.receiver_id == other.id)) |
-        ((Message.sender_id == other.id) & (Message.receiver_id == current_user.id))
-    ).order_by(Message.timestamp.asc()).all()
-    return render_template('chat.html', other=other, messages=messages)
+    messages, has_more = chat_helpers.messages_before(current_user.id, other.id, None, page_size())
+    html = render_template(
+        'chat.html', other=other, messages=messages, has_more=has_more,
+        read_up_to=chat_helpers.read_up_to(current_user.id, other.id),
+    )
+    chat_helpers.mark_read(current_user.id, other.id, messages)
+    return html
+
+
+def _send_message(other):
+    content = (request.form.get('message') or (request.get_json(silent=True) or {}).get('message') or '').strip()
+    if not content:
+        return None
+    msg = Message(sender_id=current_user.id, receiver_id=other.id, content=content[:500])
+    db.session.add(msg)
+    db.session.commit()
+    chat_helpers.notify()
+    log_activity(f'Nachricht an {other.username} gesendet')
+    return msg
+
+
+@bp.route('/social/<int:user_id>/messages', methods=['GET', 'POST'])
+@login_optional
+def chat_messages(user_id):
+    """JSON API of a chat.
+
+    ``GET ?after=<id>`` returns newer messages, with ``wait=1`` as long-poll.
+    ``GET ?before=<id>`` returns one page of older messages. ``POST`` sends
+    a message and returns it.
+    """
+    if not user_management_enabled():
+        return jsonify(error='Benutzerverwaltung ist deaktiviert'), 404
+    other = User.query.get_or_404(user_id)
+    me = current_user.id
+    if request.method == 'POST':
+        msg = _send_message(other)
+        if msg is None:
+            return jsonify(error='Leere Nachricht'), 400
+        return jsonify(message=chat_helpers.to_dict(msg, me)), 201
+
+    limit = page_size()
+    if 'before' in request.args:
+        messages, has_more = chat_helpers.messages_before(me, other.id, request.args.get('before', type=int), limit)
+        return jsonify(messages=[chat_helpers.to_dict(m, me) for m in messages], has_more=has_more)
+
+    after = request.args.get('after', 0, type=int)
+    retry = False
+    if request.args.get('wait'):
+        messages, waited = chat_helpers.wait_for_messages(me, other.id, after, limit)
+        retry = not waited
+    else:
+        messages = chat_helpers.messages_after(me, other.id, after, limit)
+    data = [chat_helpers.to_dict(m, me) for m in messages]
+    chat_helpers.mark_read(me, other.id, messages)
+    return jsonify(messages=data, retry=retry, read_up_to=chat_helpers.read_up_to(me, other.id))
@@ -0,0 +1,243 @@
+import threading
+from datetime import date, datetime, time, timedelta
+
+import click
+from sqlalchemy import Integer, String, case, cast, delete, event, func, insert, inspect, select, update
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Article, Movement, Order, OrderItem, SalesDaily, Setting
+from .utils import csv_multiplier_expression, get_setting, reference_version
+
+
+# Verkaufsstatistik -------------------------------------------------------------
+#
+# ``sales_daily`` enthält Menge, Umsatz und letzten Verkauf je Artikel und
+# Tag. Ändert sich eine Bestellung oder Position, werden die betroffenen Tage
+# innerhalb derselben Transaktion neu aggregiert. Bulk-Statements (Backup-
+# Wiederherstellung, Daten löschen) umgehen die Session-Events und bauen die
+# Tabelle deshalb komplett neu auf.
+
+SALES_STATUSES = ('bezahlt', 'versendet')
+
+_COLUMNS = ['article_id', 'day', 'quantity', 'revenue', 'last_sale']
+
+
+def _aggregate(*conditions):
+    day = func.date(Order.created_at)
+    return (
+        select(
+            OrderItem.article_id,
+            day,
+            func.sum(OrderItem.quantity),
+            func.sum(OrderItem.quantity * OrderItem.unit_price),
+            func.max(Order.created_at),
+        )
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(Order.status.in_(SALES_STATUSES), *conditions)
+        .group_by(OrderItem.article_id, day)
+    )
+
+
+def refresh_days(conn, days) -> None:
+    """Recompute the rollup rows of *days* from the orders."""
+    days = sorted({d.date() if isinstance(d, datetime) else d for d in days if d})
+    if not days:
+        return
+    # Bereichsfilter für den Index auf created_at, dann exakt auf die Tage
+    start = datetime.combine(days[0], time.min)
+    end = datetime.combine(days[-1], time.min) + timedelta(days=1)
+    conn.execute(delete(SalesDaily).where(SalesDaily.day.in_(days)))
+    conn.execute(insert(SalesDaily).from_select(_COLUMNS, _aggregate(
+        Order.created_at >= start,
+        Order.created_at < end,
+        func.date(Order.created_at).in_([d.isoformat() for d in days]),
+    )))
+
+
+def rebuild(conn) -> int:
+    """Rebuild the whole rollup and return the number of rows."""
+    conn.execute(delete(SalesDaily))
+    conn.execute(insert(SalesDaily).from_select(_COLUMNS, _aggregate()))
+    return conn.execute(select(func.count()).select_from(SalesDaily)).scalar()
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_changed_days(session, flush_context):
+    days = set()
+    order_ids = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Order):
+            state = inspect(obj)
+            if obj in session.deleted:
+                # Zeile ist schon gelöscht, Tag aus dem geladenen Objekt
+                days.add(state.dict.get('created_at'))
+            else:
+                order_ids.add(obj.id)
+            # verschobenes Bestelldatum: auch den alten Tag neu berechnen
+            days.update(state.attrs.created_at.history.deleted)
+        elif isinstance(obj, OrderItem) and obj.order_id:
+            order_ids.add(obj.order_id)
+    if not days and not order_ids:
+        return
+    conn = session.connection()
+    if order_ids:
+        days.update(conn.execute(select(Order.created_at).where(Order.id.in_(order_ids))).scalars())
+    refresh_days(conn, days)
+
+
+def period_totals(start: date | None, end: date | None, article_ids=None):
+    """Return ``{article_id: (quantity, revenue)}`` for ``start <= day < end``."""
+    query = db.session.query(SalesDaily.article_id, func.sum(SalesDaily.quantity), func.sum(SalesDaily.revenue))
+    if start:
+        query = query.filter(SalesDaily.day >= start)
+    if end:
+        query = query.filter(SalesDaily.day < end)
+    if article_ids is not None:
+        query = query.filter(SalesDaily.article_id.in_(article_ids))
+    return {aid: (qty, revenue) for aid, qty, revenue in query.group_by(SalesDaily.article_id)}
+
+
+# Rechnungsanalyse --------------------------------------------------------------
+#
+# Menge und Umsatz aller Bewegungen mit Rechnungsnummer je Artikel. Der
+# CSV-Multiplikator wird per Unterabfrage auf die Endungen in SQL ermittelt,
+# der ganze Bericht ist damit eine Abfrage. Das Ergebnis wird pro Prozess
+# zwischengespeichert, solange sich Rechnungsbewegungen, die im Bericht
+# verwendeten Artikelfelder und Referenzdaten (Einstellungen, Kategorien,
+# Endungen) nicht ändern. Neue Rechnungsbewegungen erkennt der Cache an der
+# höchsten Bewegungs-ID. Für die Artikelfelder sowie gelöschte oder geänderte
+# Rechnungsbewegungen wird in derselben Transaktion ein eigener Versionszähler
+# erhöht; Bestandsbuchungen berühren ihn nicht.
+
+INVOICE_SORTS = ('sku', 'quantity', 'revenue')
+ARTICLE_REPORT_VERSION_KEY = '_article_report_version'
+REPORT_FIELDS = ('name', 'sku', 'category', 'price')
+REPORT_MOVEMENT_FIELDS = ('article_id', 'quantity', 'invoice_number')
+
+_invoice_cache = {}
+_invoice_lock = threading.Lock()
+
+
+def touch_article_report(session=None) -> None:
+    """Bump the article report version inside the current transaction.
+
+    Needed after bulk writes to the name, SKU, category or price of
+    articles and after bulk deletes of movements, which bypass the session
+    tracking below.
+    """
+    conn = (session or db.session).connection()
+    table = Setting.__table__
+    result = conn.execute(
+        update(table)
+        .where(table.c.key == ARTICLE_REPORT_VERSION_KEY)
+        .values(value=cast(cast(table.c.value, Integer) + 1, String))
+    )
+    if not result.rowcount:
+        conn.execute(insert(table).values(key=ARTICLE_REPORT_VERSION_KEY, value='1'))
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_article_report_changes(session, flush_context, instances):
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, Article):
+            session.info['article_report_pending'] = True
+            return
+    for obj in session.deleted:
+        if isinstance(obj, Movement) and obj.invoice_number is not None:
+            session.info['article_report_pending'] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, Article):
+            fields = REPORT_FIELDS
+        elif isinstance(obj, Movement):
+            fields = REPORT_MOVEMENT_FIELDS
+        else:
+            continue
+        state = inspect(obj)
+        if any(state.attrs[field].history.has_changes() for field in fields):
+            session.info['article_report_pending'] = True
+            return
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_article_report_version(session, flush_context):
+    if session.info.pop('article_report_pending', False):
+        touch_article_report(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_article_report_changes(session):
+    session.info.pop('article_report_pending', None)
+
+
+def _invoice_high_water():
+    """Return a tuple that changes whenever the invoice report may change."""
+    setting = Setting.__table__
+    # Neue Rechnungsbewegungen erhöhen die höchste ID (rückwärts über den
+    # Primärschlüssel bis zur ersten Rechnungsbewegung, ohne Zählen); Löschen
+    # und Ändern erfasst der Versionszähler
+    newest = (
+        select(Movement.id).where(Movement.invoice_number != None)
+        .order_by(Movement.id.desc()).limit(1).scalar_subquery()
+    )
+    marks = db.session.query(
+        newest,
+        select(setting.c.value).where(setting.c.key == ARTICLE_REPORT_VERSION_KEY).scalar_subquery(),
+    ).one()
+    return (str(db.engine.url), *marks, reference_version())
+
+
+def _invoice_rows(sort: str):
+    sticker = int(get_setting('sticker_csv_multiplier', '100') or '100')
+    multiplier = func.coalesce(
+        csv_multiplier_expression(Article.sku, Article.category),
+        # Fallback für Sticker-Kategorie
+        case((func.lower(func.trim(Article.category)) == 'sticker', sticker), else_=1),
+    )
+    # Absicherung gegen fehlerhafte Werte
+    multiplier = case((multiplier < 1, 1), else_=multiplier)
+    quantity = func.sum(func.abs(Movement.quantity))
+    revenue = func.coalesce(Article.price, 0) * quantity * 1.0 / multiplier
+    order = {'quantity': quantity.desc(), 'revenue': revenue.desc()}.get(sort, Article.sku)
+    return (
+        db.session.query(
+            Article.name.label('name'),
+            Article.sku.label('sku'),
+            quantity.label('quantity'),
+            revenue.label('revenue'),
+        )
+        .join(Article, Movement.article_id == Article.id)
+        .filter(Movement.invoice_number != None)
+        .group_by(Article.id)
+        .order_by(order, Article.sku)
+        .all()
+    )
+
+
+def invoice_report(sort: str = 'sku'):
+    """Return ``(name, sku, quantity, revenue)`` rows of invoiced movements.
+
+    Sorted by SKU, or descending by quantity or revenue.
+    """
+    if sort not in INVOICE_SORTS:
+        sort = 'sku'
+    key = _invoice_high_water()
+    cached = _invoice_cache.get(sort)
+    if cached and cached[0] == key:
+        return cached[1]
+    rows = _invoice_rows(sort)
+    with _invoice_lock:
+        _invoice_cache[sort] = (key, rows)
+    return rows
+
+
+def init_app(app) -> None:
+    """Register the ``flask sales-rebuild`` command."""
+
+    @app.cli.command('sales-rebuild')
+    def sales_rebuild_command():
+        """Rebuild the daily sales rollup from all orders."""
+        rows = rebuild(db.session.connection())
+        db.session.commit()
+        click.echo(f'Verkaufsstatistik neu aufgebaut – {rows} Zeilen')
@@ -0,0 +1,82 @@
+import re
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, select, text
+
+from . import db
+from .models import ActivityLog, Article, Order
+
+
+# Volltextsuche über FTS5-Tabellen (siehe Migrationen 5, 6 und 8). Es sind
+# External-Content-Tabellen, die per Trigger synchron gehalten werden. Ohne
+# FTS5 wird wie bisher per LIKE gesucht.
+
+_metadata = MetaData()
+
+
+def _fts_table(name: str) -> Table:
+    return Table(
+        name, _metadata,
+        Column('rowid', Integer),
+        Column(name, String, key='match'),  # verborgene Spalte für MATCH
+        Column('rank', Float),
+    )
+
+
+_article_fts = _fts_table('article_fts')
+_order_fts = _fts_table('order_fts')
+_activity_log_fts = _fts_table('activity_log_fts')
+
+_available = {}
+
+
+def fts_available(table: str = 'article_fts') -> bool:
+    """Return whether the FTS table *table* exists in the current database."""
+    key = (str(db.engine.url), table)
+    if key not in _available:
+        found = False
+        if db.engine.dialect.name == 'sqlite':
+            found = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': table},
+            ).first() is not None
+        _available[key] = found
+    return _available[key]
+
+
+def fts_query(search: str) -> str | None:
+    """Turn user input into an FTS5 query of prefix terms that must all match."""
+    terms = re.findall(r'\w+', search.lower())
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _search(query, fts, key, search: str, ranked: bool, fallback):
+    expr = fts_query(search)
+    if expr is None or not fts_available(fts.name):
+        return query.filter(fallback)
+
+    matches = select(fts.c.rowid, fts.c.rank).where(fts.c.match.match(expr))
+    if not ranked:
+        return query.filter(key.in_(matches.with_only_columns(fts.c.rowid)))
+    matches = matches.subquery()
+    return query.join(matches, matches.c.rowid == key).order_by(matches.c.rank, key)
+
+
+def search_articles(query, search: str, ranked: bool = False):
+    """Restrict an Article *query* to rows matching *search*.
+
+    With *ranked* the result is ordered by relevance (bm25), best first.
+    """
+    fallback = (Article.name.contains(search)) | (Article.sku.contains(search))
+    return _search(query, _article_fts, Article.id, search, ranked, fallback)
+
+
+def search_orders(query, search: str):
+    """Restrict an Order *query* to orders whose customer matches *search*."""
+    return _search(query, _order_fts, Order.id, search, False, Order.customer_name.contains(search))
+
+
+def search_activity(query, search: str):
+    """Restrict an ActivityLog *query* to entries whose action matches *search*."""
+    return _search(query, _activity_log_fts, ActivityLog.id, search, False, ActivityLog.action.contains(search))
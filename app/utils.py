@@ -1,15 +1,31 @@
-from flask import current_app
+from flask import current_app, g, has_request_context
 from . import db
 from .models import Setting, Category, EndingCategory
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from email.message import EmailMessage
+from sqlalchemy import Integer, String, cast, event, func, insert, select, update
+from sqlalchemy.orm import Session
 import smtplib
+import threading
+import time
 import os
 
 
+def is_bookkeeping_key(key: str | None) -> bool:
+    """Return whether *key* is internal state rather than configuration.
+
+    Bookkeeping settings (``_...``, ``last_...``) change on backups and
+    restores; they neither bump the reference version nor come from its cache.
+    """
+    return bool(key) and (key.startswith('_') or key.startswith('last_'))
+
+
 def get_setting(key: str, default: str = '') -> str:
-    s = Setting.query.filter_by(key=key).first()
-    return s.value if s else default
+    if is_bookkeeping_key(key):
+        table = Setting.__table__
+        value = db.session.execute(select(table.c.value).where(table.c.key == key)).scalar()
+        return default if value is None else value
+    return _reference_data().settings.get(key, default)
 
 
 def set_setting(key: str, value: str) -> None:
@@ -37,10 +53,14 @@ DEFAULT_PREFIX_STRING = 'ST-:Sticker:0:1000\nSC-:Schal:0:20\nSH-:Shirt:0:10'
 
 def _get_prefix_definitions() -> dict:
     """Return mapping of SKU prefixes to ``(category, price, min_stock)`` tuples."""
+    return get_rule_index().definitions
+
+
+def _parse_prefix_definitions(categories: list, settings: dict) -> dict:
     mapping = {}
     
     # Prefer definitions stored in the Category table
-    for cat in Category.query.all():
+    for cat in categories:
         if cat.prefix:
             mapping[cat.prefix] = (
                 cat.name,
@@ -52,7 +72,7 @@ def _get_prefix_definitions() -> dict:
         return mapping
 
     # Fallback to stored setting (for compatibility / first start)
-    raw = get_setting('category_prefixes', DEFAULT_PREFIX_STRING)
+    raw = settings.get('category_prefixes', DEFAULT_PREFIX_STRING)
     for line in raw.splitlines():
         if ':' not in line:
             continue
@@ -76,9 +96,208 @@ def _get_prefix_definitions() -> dict:
             mapping[prefix] = (category, price, min_stock)
     return mapping
 
+# Compiled SKU rules -------------------------------------------------------
+
+_TRIE_HIT = None  # dict key holding the payload of a trie node
+
+
+def _trie_insert(root: dict, key, order: int, payload) -> None:
+    node = root
+    for ch in key:
+        node = node.setdefault(ch, {})
+    # Bei doppelten Schlüsseln gewinnt wie bisher die zuerst definierte Regel
+    hit = node.get(_TRIE_HIT)
+    if hit is None or hit[0] > order:
+        node[_TRIE_HIT] = (order, payload)
+
+
+def _trie_match(root: dict, chars):
+    """Return the payload of the earliest defined key that prefixes *chars*."""
+    node = root
+    best = node.get(_TRIE_HIT)
+    for ch in chars:
+        node = node.get(ch)
+        if node is None:
+            break
+        hit = node.get(_TRIE_HIT)
+        if hit is not None and (best is None or hit[0] < best[0]):
+            best = hit
+    return best[1] if best else None
+
+
+class RuleIndex:
+    """Prefix and reversed-suffix tries compiled from categories and endings."""
+
+    def __init__(self, definitions: dict, endings: list):
+        self.definitions = definitions
+        self.category_defaults = {}
+        self._prefixes = {}
+        for order, (prefix, values) in enumerate(definitions.items()):
+            _trie_insert(self._prefixes, prefix, order, values)
+            self.category_defaults.setdefault(values[0], values)
+
+        # One trie over all endings plus one per category
+        self._suffixes = {None: {}}
+        for order, (suffix, category, price, multiplier) in enumerate(endings):
+            payload = (price, multiplier)
+            _trie_insert(self._suffixes[None], reversed(suffix), order, payload)
+            _trie_insert(self._suffixes.setdefault(category, {}), reversed(suffix), order, payload)
+
+    def match_prefix(self, sku: str):
+        """Return ``(category, price, min_stock)`` for the prefix of *sku*."""
+        return _trie_match(self._prefixes, sku)
+
+    def match_suffix(self, sku: str, category: str | None = None):
+        """Return ``(price, csv_multiplier)`` of the ending matching *sku*."""
+        trie = self._suffixes.get(category)
+        if trie is None:
+            return None
+        return _trie_match(trie, reversed(sku))
+
+
+# Reference data cache -----------------------------------------------------
+#
+# Settings, categories and endings are read on almost every request but change
+# rarely. They are cached per process; a version counter stored as setting row
+# is bumped in the same transaction as every change, so other worker processes
+# notice it with a single cheap lookup per request.
+
+REFERENCE_VERSION_KEY = '_reference_version'
+_REFERENCE_MODELS = (Setting, Category, EndingCategory)
+
+
+class _ReferenceData:
+    """Immutable snapshot of settings, categories and compiled SKU rules."""
+
+    def __init__(self, version: str | None):
+        self.version = version
+        self.settings = {s.key: s.value for s in Setting.query.all()}
+        categories = Category.query.order_by(Category.id).all()
+        self.categories = sorted(c.name for c in categories)
+        endings = [
+            (e.suffix or '', e.category, e.price, e.csv_multiplier)
+            for e in EndingCategory.query.order_by(EndingCategory.id).all()
+        ]
+        definitions = _parse_prefix_definitions(categories, self.settings)
+        self.rule_index = RuleIndex(definitions, endings)
+
+
+_reference = None
+_reference_generation = 0
+_reference_checked_at = 0.0
+_reference_lock = threading.Lock()
+
+
+def _read_reference_version() -> str | None:
+    table = Setting.__table__
+    return db.session.execute(
+        select(table.c.value).where(table.c.key == REFERENCE_VERSION_KEY)
+    ).scalar()
+
+
+def _reference_check_due() -> bool:
+    """Return ``True`` if the shared version should be compared again."""
+    global _reference_checked_at
+    if has_request_context():
+        # Einmal pro Request reicht
+        if g.get('_reference_checked'):
+            return False
+        g._reference_checked = True
+        return True
+    interval = current_app.config.get('REFERENCE_CACHE_CHECK_INTERVAL', 1.0)
+    now = time.monotonic()
+    if now - _reference_checked_at < interval:
+        return False
+    _reference_checked_at = now
+    return True
+
+
+def _reference_data() -> _ReferenceData:
+    global _reference
+    data = _reference
+    if data is not None and not _reference_check_due():
+        return data
+    version = _read_reference_version()
+    if data is not None and data.version == version:
+        return data
+    with _reference_lock:
+        generation = _reference_generation
+    data = _ReferenceData(version)
+    with _reference_lock:
+        # Nicht speichern, falls während des Aufbaus invalidiert wurde
+        if generation == _reference_generation:
+            _reference = data
+    return data
+
+
+def get_rule_index() -> RuleIndex:
+    """Return the compiled SKU rules, building them on first use."""
+    return _reference_data().rule_index
+
+
+def reference_version() -> str | None:
+    """Return the version of the settings, categories and endings in use."""
+    return _reference_data().version
+
+
+def invalidate_reference_cache() -> None:
+    """Drop the cached reference data of this process."""
+    global _reference, _reference_generation
+    with _reference_lock:
+        _reference = None
+        _reference_generation += 1
+
+
+def touch_reference_data(session=None) -> None:
+    """Bump the shared reference version inside the current transaction.
+
+    Needed after bulk ``query.update()``/``query.delete()`` calls on settings,
+    categories or endings, which bypass the session tracking below.
+    """
+    session = session or db.session
+    conn = session.connection()
+    table = Setting.__table__
+    result = conn.execute(
+        update(table)
+        .where(table.c.key == REFERENCE_VERSION_KEY)
+        .values(value=cast(cast(table.c.value, Integer) + 1, String))
+    )
+    if not result.rowcount:
+        conn.execute(insert(table).values(key=REFERENCE_VERSION_KEY, value='1'))
+    session.info['reference_changed'] = True
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_reference_changes(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Setting) and is_bookkeeping_key(obj.key):
+            continue
+        if isinstance(obj, _REFERENCE_MODELS):
+            session.info['reference_pending'] = True
+            return
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_reference_version(session, flush_context):
+    if session.info.pop('reference_pending', False):
+        touch_reference_data(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('reference_changed', False):
+        invalidate_reference_cache()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_reference_changes(session):
+    session.info.pop('reference_pending', None)
+    session.info.pop('reference_changed', None)
+
+
 def get_category_prefixes() -> dict:
     """Return mapping of SKU prefixes to category names."""
-    return {p: c for p, (c, _, _) in _get_prefix_definitions().items()}
+    return {p: c for p, (c, _, _) in get_rule_index().definitions.items()}
 
 
 
@@ -95,56 +314,72 @@ def save_category_prefixes(mapping: dict) -> None:
 
 def get_categories() -> list:
     """Return list of all category names from the database."""
-    return [c.name for c in Category.query.order_by(Category.name).all()]
+    return list(_reference_data().categories)
 
 
 def category_from_sku(sku: str) -> str | None:
     """Try to determine category by SKU prefix."""
-    for prefix, category in get_category_prefixes().items():
-        if sku.startswith(prefix):
-            return category
-    return None
+    match = get_rule_index().match_prefix(sku)
+    return match[0] if match else None
 
 def price_from_sku(sku: str) -> float | None:
     """Return default price configured for the prefix of *sku*."""
-    for prefix, (_, price, _) in _get_prefix_definitions().items():
-        if sku.startswith(prefix):
-            return price
-    return None
+    match = get_rule_index().match_prefix(sku)
+    return match[1] if match else None
 
 
 def get_default_price(category: str) -> float:
     """Return default price for *category* or ``0.0`` if not defined."""
-    for _, (cat, price, _) in _get_prefix_definitions().items():
-        if cat == category:
-            return price
-    return 0.0
+    values = get_rule_index().category_defaults.get(category)
+    return values[1] if values else 0.0
 
 def get_default_minimum_stock(category: str) -> int:
     """Return default minimum stock for *category* or ``0`` if not defined."""
-    for _, (cat, _, min_stock) in _get_prefix_definitions().items():
-        if cat == category:
-            return min_stock
+    values = get_rule_index().category_defaults.get(category)
+    if values:
+        return values[2]
     return DEFAULT_MIN_STOCK.get(category.lower(), 0)
 
 def price_from_suffix(sku: str, category: str | None = None) -> float | None:
     """Return unit price configured for a specific combination of category and SKU suffix."""
-    for end in EndingCategory.query.all():
-        if sku.endswith(end.suffix) and (category is None or end.category == category):
-            price = end.price
-            multiplier = end.csv_multiplier or 1
-            if multiplier and multiplier > 1:
-                price = price / multiplier
-            return price
-    return None
+    match = get_rule_index().match_suffix(sku, category)
+    if match is None:
+        return None
+    price, multiplier = match
+    multiplier = multiplier or 1
+    if multiplier and multiplier > 1:
+        price = price / multiplier
+    return price
 
 
 def csv_multiplier_from_suffix(sku: str, category: str | None = None) -> int | None:
     """Return CSV multiplier for a specific combination of category and SKU suffix."""
-    for end in EndingCategory.query.all():
-        if sku.endswith(end.suffix) and (category is None or end.category == category):
-            return end.csv_multiplier or 1
-    return None
+    match = get_rule_index().match_suffix(sku, category)
+    if match is None:
+        return None
+    return match[1] or 1
+
+
+def csv_multiplier_expression(sku, category):
+    """SQL counterpart of :func:`csv_multiplier_from_suffix` for column expressions.
+
+    Returns a correlated scalar subquery that picks the earliest defined
+    ending matching the end of *sku* (within *category*, or across all
+    categories when it is ``NULL``), so a whole report can resolve its
+    multipliers in one statement. ``NULL`` means no ending matched.
+    """
+    ending = EndingCategory.__table__.c
+    suffix_matches = (ending.suffix == '') | (
+        func.substr(sku, func.length(sku) - func.length(ending.suffix) + 1) == ending.suffix
+    )
+    return (
+        select(func.coalesce(func.nullif(ending.csv_multiplier, 0), 1))
+        .where(suffix_matches, (category == None) | (ending.category == category))
+        .order_by(ending.id)
+        .limit(1)
+        .correlate_except(EndingCategory.__table__)
+        .scalar_subquery()
+    )
 
 def generate_reset_token(user_id: int) -> str:
     """Return a signed token for password reset."""
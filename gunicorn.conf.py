@@ -0,0 +1,50 @@
+# gunicorn-Konfiguration für den Betrieb unter Linux:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Alle Werte lassen sich über Umgebungsvariablen anpassen.
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# SQLite erlaubt nur einen Schreiber gleichzeitig; mehr als eine Handvoll
+# Prozesse bringt daher kaum zusätzlichen Durchsatz.
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Die App begrenzt wartende Chat-Long-Polls anhand der Threads pro Worker
+os.environ['SERVER_THREADS'] = str(threads)
+
+# App einmal im Master laden: Migrationen, Admin-Anlage und das Aufräumen
+# abgebrochener Jobs laufen genau einmal statt in jedem Worker.
+preload_app = True
+
+# gthread: Worker gilt erst nach so vielen Sekunden ohne Lebenszeichen als
+# hängend; lange Exporte und Uploads laufen in eigenen Threads weiter.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Bei SIGHUP/SIGTERM laufende Requests so lange zu Ende bearbeiten
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+# Worker regelmäßig erneuern, um Speicherwachstum zu begrenzen
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+
+# leer = kein Access-Log
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+errorlog = '-'
+
+
+# Jobs laufen in Threads der Worker. Wird ein Worker erneuert (max_requests)
+# oder nach ``timeout`` abgebrochen, seine unfertigen Jobs als fehlgeschlagen
+# markieren, statt sie bis zum nächsten Start des Masters hängen zu lassen.
+def _stop_jobs(worker):
+    worker.app.wsgi().extensions['jobs'].shutdown()
+
+
+def worker_exit(server, worker):
+    _stop_jobs(worker)
+
+
+def worker_abort(worker):
+    _stop_jobs(worker)
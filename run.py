@@ -3,4 +3,5 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", debug=True)
+    # Entwicklungsserver; für den Betrieb serve.py bzw. gunicorn verwenden
+    app.run(host="0.0.0.0", debug=app.debug)
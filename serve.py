@@ -0,0 +1,25 @@
+"""Production server for Windows and other systems without gunicorn.
+
+Runs the app with waitress (multi-threaded, no debugger/reloader)::
+
+    python serve.py
+"""
+import os
+
+from waitress import serve
+
+THREADS = int(os.environ.get('WAITRESS_THREADS', 8))
+# Die App begrenzt wartende Chat-Long-Polls anhand der Server-Threads
+os.environ['SERVER_THREADS'] = str(THREADS)
+
+from wsgi import app  # noqa: E402
+
+if __name__ == '__main__':
+    serve(
+        app,
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 5000)),
+        threads=THREADS,
+        connection_limit=int(os.environ.get('WAITRESS_CONNECTION_LIMIT', 100)),
+        channel_timeout=int(os.environ.get('WAITRESS_CHANNEL_TIMEOUT', 120)),
+    )
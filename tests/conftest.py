@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from app import create_app, db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', 'sqlite:///' + os.path.join(tmp_path, 'test.db'))
+    monkeypatch.setenv('JOB_WORKERS', '0')
+    monkeypatch.setenv('ACTIVITY_LOG_FLUSH_SECONDS', '0')
+    monkeypatch.setenv('ACTIVITY_LOG_ARCHIVE_FOLDER', str(tmp_path / 'archive'))
+    app = create_app()
+    app.config['TESTING'] = True
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,21 @@
+from datetime import date, datetime
+
+from app import db
+from app.models import Article, SalesDaily
+
+
+def test_analysis_totals_leave_out_deleted_articles(app, client):
+    with app.app_context():
+        kept = Article(name='Schal', sku='SC-100', stock=5)
+        gone = Article(name='Mütze', sku='MU-100', stock=5)
+        db.session.add_all([kept, gone])
+        db.session.flush()
+        for article, quantity in ((kept, 2), (gone, 3)):
+            db.session.add(SalesDaily(article_id=article.id, day=date(2024, 2, 1), quantity=quantity,
+                                      revenue=quantity * 10.0, last_sale=datetime(2024, 2, 1, 12)))
+        db.session.commit()
+        gone_id = gone.id
+
+    assert client.get(f'/article/{gone_id}/delete').status_code == 302
+    page = client.get('/analysis').get_data(as_text=True)
+    assert 'Gesamt: 2 Stück, 20.00 €' in page
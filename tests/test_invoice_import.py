@@ -0,0 +1,31 @@
+import csv
+import io
+
+from app import db
+from app.importer import import_invoice_rows
+from app.models import Article, Movement
+
+EXPORT = (
+    'Rechnung;Datum;Posten: Artikelnummer;Posten: Anzahl\n'
+    'R-1;01.02.2024 10:00:00;SC-100;2\n'
+    'R-1;01.02.2024 10:00:00;SC-100;2\n'
+    'R-2;02.02.2024 11:00:00;SC-100;1\n'
+)
+
+
+def _rows(text):
+    return csv.DictReader(io.StringIO(text), delimiter=';')
+
+
+def test_uploading_an_invoice_export_again_books_nothing_twice(app):
+    with app.app_context():
+        db.session.add(Article(name='Schal', sku='SC-100', category='Schals', stock=20))
+        db.session.commit()
+
+        # Erster Versuch bricht nach der ersten Zeile ab
+        partial = EXPORT.split('\n', 2)
+        assert import_invoice_rows(_rows('\n'.join(partial[:2]) + '\n'), 'Rechnung', 'Datum') == (1, 0)
+
+        assert import_invoice_rows(_rows(EXPORT), 'Rechnung', 'Datum', chunk_size=2) == (2, 1)
+        assert Movement.query.count() == 3
+        assert db.session.query(Article.stock).scalar() == 15
@@ -0,0 +1,46 @@
+from app import db
+from app.models import Article, EndingCategory, Movement
+from app.sales import invoice_report
+
+
+def _revenue(app, sku):
+    with app.app_context():
+        return {row.sku: row.revenue for row in invoice_report()}[sku]
+
+
+def test_applying_an_ending_price_updates_the_cached_report(app, client):
+    with app.app_context():
+        article = Article(name='Schal', sku='SC-100X', category='Schals', price=10.0, stock=5)
+        db.session.add(article)
+        db.session.flush()
+        db.session.add(Movement(article_id=article.id, quantity=-2, type='Warenausgang', invoice_number='R-1'))
+        ending = EndingCategory(category='Schals', suffix='X', price=4.5)
+        db.session.add(ending)
+        db.session.commit()
+        ending_id = ending.id
+
+    assert _revenue(app, 'SC-100X') == 20.0
+
+    response = client.post(f'/settings/endings/{ending_id}/apply')
+    assert response.status_code == 302
+
+    assert _revenue(app, 'SC-100X') == 9.0
+
+
+def test_new_and_deleted_invoice_movements_update_the_cached_report(app):
+    with app.app_context():
+        article = Article(name='Schal', sku='SC-100', category='Schals', price=10.0, stock=5)
+        db.session.add(article)
+        db.session.flush()
+        first = Movement(article_id=article.id, quantity=-2, type='Warenausgang', invoice_number='R-1')
+        db.session.add(first)
+        db.session.commit()
+        assert _revenue(app, 'SC-100') == 20.0
+
+        db.session.add(Movement(article_id=article.id, quantity=-1, type='Warenausgang', invoice_number='R-2'))
+        db.session.commit()
+        assert _revenue(app, 'SC-100') == 30.0
+
+        db.session.delete(first)
+        db.session.commit()
+        assert _revenue(app, 'SC-100') == 10.0
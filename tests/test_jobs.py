@@ -0,0 +1,28 @@
+import threading
+
+from app import db, jobs
+from app.models import Job
+
+
+def test_shutdown_fails_the_unfinished_jobs_of_the_process(app, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(job, progress):
+        started.set()
+        release.wait(5)
+        raise ValueError('abgebrochen')
+
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'article_import', blocking)
+    app.config['JOB_WORKERS'] = 1
+    runner = app.extensions['jobs'] = jobs.JobRunner(app)
+    with app.app_context():
+        running = jobs.enqueue('article_import')
+        queued = jobs.enqueue('article_import')
+        assert started.wait(5)
+
+        runner.shutdown()
+        db.session.expire_all()
+        for job_id in (running.id, queued.id):
+            job = db.session.get(Job, job_id)
+            assert (job.status, job.message) == ('fehlgeschlagen', jobs.ABORTED_MESSAGE)
+    release.set()
@@ -0,0 +1,23 @@
+from app import db
+from app.ledger import add_stock, reconcile
+from app.models import Article, Movement, StockSnapshot
+
+
+def test_reconcile_counts_movements_up_to_the_snapshot_once(app):
+    with app.app_context():
+        article = Article(name='Schal', sku='SC-100', stock=10)
+        db.session.add(article)
+        db.session.commit()
+        assert reconcile()['new'] == 1
+        db.session.commit()
+
+        db.session.add(Movement(article_id=article.id, quantity=5, type='Wareneingang'))
+        add_stock(article, 5)
+        db.session.commit()
+        assert reconcile()['drift'] == 0
+        db.session.commit()
+
+        latest = StockSnapshot.query.order_by(StockSnapshot.id.desc()).first()
+        assert (latest.stock, latest.expected) == (15, 15)
+        assert latest.last_movement_id == db.session.query(db.func.max(Movement.id)).scalar()
+        assert reconcile()['snapshots'] == 0
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from app import db, pagination
+from app.ledger import add_stock
+from app.models import Article
+
+
+def test_count_cache_keeps_at_most_the_configured_entries(app):
+    app.config['COUNT_CACHE_MAX_ENTRIES'] = 3
+    pagination.invalidate_counts()
+    with app.app_context():
+        for search in ('a', 'ab', 'abc', 'abcd', 'abcde'):
+            pagination.cached_count(('articles', search), Article.query)
+    assert list(pagination._count_cache) == [('articles', 'abc'), ('articles', 'abcd'), ('articles', 'abcde')]
+
+
+def test_stock_bookings_invalidate_the_understock_count(app):
+    pagination.invalidate_counts()
+    with app.app_context():
+        article = Article(name='Schal', sku='SC-100', stock=5, minimum_stock=3)
+        db.session.add(article)
+        db.session.commit()
+        understock = Article.query.filter(Article.stock < Article.minimum_stock)
+        key = ('articles', None, None, '1', None)
+        assert pagination.cached_count(key, understock) == 0
+
+        add_stock(article, -4)
+        db.session.commit()
+        assert pagination.cached_count(key, understock) == 1
+
+
+def test_cursor_of_another_sort_order_starts_on_the_first_page():
+    token = pagination.encode_cursor(['Schal', 7])
+    assert pagination.decode_cursor(token, (str, int)) == ['Schal', 7]
+    assert pagination.decode_cursor(token, (int,)) is None
+    assert pagination.decode_cursor(pagination.encode_cursor([{'dt': 'kaputt'}, 1]), (datetime, int)) is None
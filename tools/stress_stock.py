@@ -0,0 +1,164 @@
+"""Concurrency check for stock bookings.
+
+Starts several processes with several threads each. Every thread logs in
+and fires random orders and goods receipts at the same article through the
+Flask test client. Every request must end in the expected redirect (an
+order may be rejected for lack of stock); any other status or an exception
+such as a lock timeout fails the run. Afterwards the stock must be
+non-negative and match the start value plus all movements, and every booked
+order must have exactly one order item and one movement.
+
+Runs against a throw-away SQLite database in a temporary directory::
+
+    python tools/stress_stock.py --processes 4 --threads 8 --requests 50
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SKU = 'STRESS-1'
+
+
+def _create_app():
+    from app import create_app
+
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+def _client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == 302, 'Login fehlgeschlagen'
+    return client
+
+
+def _outcome(response, expected: dict) -> str | None:
+    """Map a response to the key of the matching expected redirect, else ``None``."""
+    if response.status_code != 302:
+        return None
+    location = urlsplit(response.headers.get('Location', '')).path
+    for key, pattern in expected.items():
+        if pattern.fullmatch(location):
+            return key
+    return None
+
+
+def _hammer(app, article_id: int, requests: int, results: list) -> None:
+    client = _client(app)
+    rng = random.Random()
+    counts = dict(orders=0, booked=0, rejected=0, receipts=0, failures=0)
+    order_redirects = {
+        'booked': re.compile(r'/orders/\d+'),
+        'rejected': re.compile(r'/orders/new'),
+    }
+    receipt_redirects = {'receipts': re.compile(rf'/article/{article_id}/history')}
+    for _ in range(requests):
+        qty = rng.randint(1, 5)
+        is_order = rng.random() < 0.7
+        try:
+            if is_order:
+                counts['orders'] += 1
+                response = client.post('/orders/new', data={
+                    'customer_name': 'Last', 'status': 'offen',
+                    f'qty_{article_id}': str(qty), f'price_{article_id}': '1',
+                })
+                outcome = _outcome(response, order_redirects)
+            else:
+                response = client.post(f'/movement/{article_id}/new', data={'quantity': str(qty), 'type': 'Wareneingang'})
+                outcome = _outcome(response, receipt_redirects)
+            if outcome is None:
+                print(f'Unerwartete Antwort: {response.status_code} {response.headers.get("Location", "")}')
+        except Exception as e:
+            print(f'Request fehlgeschlagen: {e!r}')
+            outcome = None
+        counts[outcome or 'failures'] += 1
+    results.append(counts)
+
+
+def _worker(article_id: int, threads: int, requests: int, queue) -> None:
+    app = _create_app()
+    results = []
+    pool = [threading.Thread(target=_hammer, args=(app, article_id, requests, results)) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    queue.put(results)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='Requests pro Thread')
+    parser.add_argument('--stock', type=int, default=200, help='Anfangsbestand')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='stress_stock_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'stress.db')
+    os.environ['JOB_WORKERS'] = '0'
+
+    app = _create_app()
+    from app import db
+    from app.models import Article, Movement, OrderItem
+
+    with app.app_context():
+        article = Article(name='Stresstest', sku=SKU, stock=args.stock, minimum_stock=0)
+        db.session.add(article)
+        db.session.commit()
+        article_id = article.id
+
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(article_id, args.threads, args.requests, queue))
+             for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    results = [r for _ in procs for r in queue.get()]
+    for p in procs:
+        p.join()
+
+    with app.app_context():
+        stock = db.session.get(Article, article_id).stock
+        booked = db.session.query(db.func.coalesce(db.func.sum(Movement.quantity), 0)).filter(
+            Movement.article_id == article_id).scalar()
+        items = OrderItem.query.filter_by(article_id=article_id).count()
+        outgoing = Movement.query.filter_by(article_id=article_id, type='Warenausgang').count()
+
+    total = {key: sum(r[key] for r in results) for key in results[0]}
+    print(f"Bestellungen gesendet: {total['orders']}, davon gebucht: {total['booked']}, "
+          f"mangels Bestand abgelehnt: {total['rejected']}; Wareneingänge: {total['receipts']}")
+    print(f'Bestand: {stock} (Start {args.stock} + Bewegungen {booked} = {args.stock + booked})')
+
+    errors = []
+    if total['failures']:
+        errors.append(f"{total['failures']} Requests mit unerwarteter Antwort oder Fehler")
+    if len(results) != args.processes * args.threads:
+        errors.append('Nicht alle Threads haben ihre Requests abgeschlossen')
+    if items != total['booked']:
+        errors.append('Gebuchte Bestellungen und Bestellpositionen weichen ab')
+    if stock != args.stock + booked:
+        errors.append('Bestand stimmt nicht mit den Bewegungen überein')
+    if stock < 0:
+        errors.append('Bestand ist negativ (Überverkauf)')
+    if items != outgoing:
+        errors.append('Bestellpositionen und Warenausgänge weichen ab')
+    for error in errors:
+        print('FEHLER:', error)
+    print('OK' if not errors else 'FEHLGESCHLAGEN')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())